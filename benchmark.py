@@ -0,0 +1,178 @@
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+from load_data import load_data
+from data_cleaning import GEO_FEATURES, def_geo_features, pipline, get_spatial_data
+import k_means
+from k_means import find_optimal_k, kmeans_clustering
+from db_scan import find_optimal_eps, dbscan_clustering
+from data_analysis import analyze_clusters
+from cluster_mapping import visualize_clusters_map
+from synthetic_data import generate_crash_data
+
+SIZES = [10_000, 100_000, 1_000_000]
+STAGES = ['load_data', 'pipline', 'get_spatial_data', 'find_optimal_k', 'find_optimal_eps',
+          'dbscan_clustering', 'kmeans_clustering', 'analyze_clusters', 'visualize_clusters_map']
+
+def run_benchmarks(sizes=SIZES, stages=STAGES, workdir=None, seed=42, dbscan_algorithm='sklearn'):
+    """Time every pipeline stage on synthetic extracts of each size
+
+    Each stage is fed the previous stages' outputs. Stages not selected still
+    run (unmeasured) when a later stage needs their output. Returns a list of
+    {'stage', 'rows', 'wall_s', 'cpu_s', 'peak_mb', 'children_peak_mb'} dicts.
+
+    Each measured stage runs twice: once timed, and once under tracemalloc,
+    whose allocation hooks would otherwise slow the timed run. peak_mb is
+    tracemalloc's peak for the main process's heap only. children_peak_mb is
+    the largest resident set of any worker process that had exited by the end
+    of the stage, a high-water mark over the whole run; workers still alive
+    in a joblib pool are not counted until they exit.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='crash_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+
+    for n_rows in sizes:
+        csv_path = os.path.join(workdir, f'crash_data_{n_rows}.csv')
+        if not os.path.exists(csv_path):
+            generate_crash_data(n_rows, seed=seed).to_csv(csv_path, index=False)
+        cache_dir = os.path.join(workdir, 'cache')
+        columns = GEO_FEATURES + ['Crash Year']
+
+        def stage(name, func):
+            if name not in stages:
+                with redirect_stdout(io.StringIO()):
+                    return func()
+            result, metrics = _measure(func)
+            metrics = {'stage': name, 'rows': n_rows, **metrics}
+            results.append(metrics)
+            print(f"{name:>24} {n_rows:>9} rows  {metrics['wall_s']:8.3f} s  {metrics['peak_mb']:9.1f} MB heap  "
+                  f"{metrics['children_peak_mb']:9.1f} MB workers")
+            return result
+
+        # Build the column cache outside the timing, so load_data measures the steady state
+        with redirect_stdout(io.StringIO()):
+            load_data(columns=columns, path=csv_path, cache_dir=cache_dir)
+
+        crash_data = stage('load_data', lambda: load_data(columns=columns, path=csv_path, cache_dir=cache_dir))
+        with redirect_stdout(io.StringIO()):
+            crash_data_geo = def_geo_features(crash_data=crash_data)
+
+        stage('pipline', lambda: pipline(crash_data_geo=crash_data_geo))
+        _, scaled_coords, original_coords, _ = stage(
+            'get_spatial_data', lambda: get_spatial_data(crash_data_geo=crash_data_geo)
+        )
+
+        if 'find_optimal_k' in stages:
+            stage('find_optimal_k', lambda: find_optimal_k(spatial_data=scaled_coords))
+        eps = stage('find_optimal_eps', lambda: find_optimal_eps(spatial_data=scaled_coords)) or 0.05
+
+        if 'dbscan_clustering' in stages:
+            stage('dbscan_clustering', lambda: dbscan_clustering(spatial_data=scaled_coords, eps=eps,
+                                                                 algorithm=dbscan_algorithm))
+        _, kmeans_labels = stage('kmeans_clustering', lambda: kmeans_clustering(spatial_data=scaled_coords,
+                                                                                n_clusters=8))
+
+        if 'analyze_clusters' in stages:
+            stage('analyze_clusters', lambda: analyze_clusters(crash_data_geo=crash_data_geo,
+                                                               cluster_labels=kmeans_labels))
+        if 'visualize_clusters_map' in stages:
+            # Rendering the HTML is part of the cost of a map
+            stage('visualize_clusters_map', lambda: visualize_clusters_map(
+                original_coords=original_coords, cluster_labels=kmeans_labels, method_name=None
+            ).get_root().render())
+
+    return results
+
+def compare_results(baseline, current):
+    """Table of wall-time and peak-memory ratios (current / baseline) per stage and size"""
+    base = pd.DataFrame(baseline['results']).set_index(['stage', 'rows'])
+    curr = pd.DataFrame(current['results']).set_index(['stage', 'rows'])
+    table = base[['wall_s', 'peak_mb']].join(curr[['wall_s', 'peak_mb']], lsuffix='_base', rsuffix='_new',
+                                              how='inner')
+    table['wall_ratio'] = table['wall_s_new'] / table['wall_s_base']
+    table['peak_ratio'] = table['peak_mb_new'] / table['peak_mb_base']
+    return table
+
+def _measure(func):
+    _cold_start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    with redirect_stdout(io.StringIO()):
+        result = func()
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    del result
+
+    # A second run for memory, since tracemalloc slows allocation-heavy stages unevenly
+    _cold_start()
+    tracemalloc.start()
+    with redirect_stdout(io.StringIO()):
+        result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # ru_maxrss is in KiB on Linux
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 2**10
+
+    return result, {'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4), 'peak_mb': round(peak / 2**20, 2),
+                    'children_peak_mb': round(children_peak / 2**20, 2)}
+
+def _cold_start():
+    # Both runs of a stage must recompute, not read the elbow curves the other one stored
+    k_means._SWEEP_CACHE.clear()
+    gc.collect()
+
+def _metadata(seed):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'git_commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the crash clustering pipeline on synthetic data")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', help="Directory for the synthetic CSVs and cache (default: a temp dir)")
+    parser.add_argument('--dbscan-algorithm', choices=['sklearn', 'grid'], default='sklearn')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        print(compare_results(baseline, current).to_string(float_format='{:.3f}'.format))
+    else:
+        results = run_benchmarks(sizes=args.sizes, stages=args.stages, workdir=args.workdir,
+                                 seed=args.seed, dbscan_algorithm=args.dbscan_algorithm)
+        with open(args.output, 'w') as f:
+            json.dump({'meta': _metadata(args.seed), 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
@@ -1,39 +1,53 @@
+import json
+
 import folium
-from folium.plugins import HeatMap
+from folium.plugins import FastMarkerCluster, HeatMap
 import matplotlib.colors as mcolors
 import matplotlib.pyplot as plt
-from sklearn.preprocessing import StandardScaler
 import numpy as np
+from scipy.spatial import ConvexHull, QhullError
+from report import show_figure
+from grid_pyramid import cell_polygons, level_with_at_most
 
-def plot_clusters(spatial_data, original_coords, cluster_labels, method_name):
-    """Visualize clustering results"""
-    unique_labels = np.unique(cluster_labels)
+def plot_clusters(spatial_data, original_coords, cluster_labels, method_name, scaler=None,
+                  mode='auto', bins=800):
+    """Visualize clustering results
+
+    mode='scatter' draws every point in one rasterized scatter call, colored
+    from a label-indexed color array (noise in translucent black).
+    mode='density' bins the points into a bins x bins image, each pixel taking
+    the mean color of its points and an opacity that grows with their count,
+    and draws it with one imshow call. mode='auto' uses 'scatter' up to 100k
+    points. KMeans centers are mapped back to
+    lon/lat with the fitted scaler from get_spatial_data.
+    """
+    coords = np.asarray(original_coords, dtype=np.float64)[:, :2]
+    cluster_labels = np.asarray(cluster_labels)
+    unique_labels, label_codes = np.unique(cluster_labels, return_inverse=True)
     num_clusters = len(unique_labels)
 
     colors = plt.cm.rainbow(np.linspace(0, 1, num_clusters))
-    colormap = {}
-
-    for i, label in enumerate(unique_labels):
-        if label == -1:
-            colormap[label] = 'black'  # Noise points in black
-        else:
-            colormap[label] = colors[i]
+    colors[:, 3] = 0.8
+    if unique_labels[0] == -1:
+        colors[0] = (0, 0, 0, 0.5)  # Noise points in black
+    point_colors = colors[label_codes]
+    if mode == 'auto':
+        mode = 'scatter' if len(coords) <= 100_000 else 'density'
 
     plt.figure(figsize=(12, 10))
 
-    for label in unique_labels:
-        mask = cluster_labels == label
-        marker = 'x' if label == -1 else 'o'
-        alpha = 0.5 if label == -1 else 0.8
-        plt.scatter(
-            original_coords.iloc[mask, 0],
-            original_coords.iloc[mask, 1],
-            c=[colormap[label]],
-            marker=marker,
-            alpha=alpha,
-            s=50 if label == -1 else 70,
-            label=f"Cluster {label}" if label != -1 else "Noise"
-        )
+    if mode == 'scatter':
+        plt.scatter(coords[:, 0], coords[:, 1], c=point_colors, s=20, linewidths=0, rasterized=True)
+    elif mode == 'density':
+        _draw_density(coords, point_colors, bins)
+    else:
+        raise ValueError(f"Unknown plot mode: {mode}")
+
+    # Proxy legend entries, skipped when there are too many clusters to read
+    if num_clusters <= 20:
+        for label, color in zip(unique_labels, colors):
+            plt.scatter([], [], c=[color], marker='x' if label == -1 else 'o',
+                        label=f"Cluster {label}" if label != -1 else "Noise")
 
     if hasattr(method_name, 'cluster_centers_'):
         centers = method_name.cluster_centers_
@@ -53,18 +67,62 @@ def plot_clusters(spatial_data, original_coords, cluster_labels, method_name):
     plt.title(f'Spatial Clusters using {type(method_name).__name__}', fontsize=16)
     plt.xlabel('Longitude (x)', fontsize=14)
     plt.ylabel('Latitude (y)', fontsize=14)
-    plt.legend(fontsize=12)
+    if plt.gca().get_legend_handles_labels()[0]:
+        plt.legend(fontsize=12)
     plt.grid(True, alpha=0.3)
     plt.tight_layout()
-    plt.show()
+    show_figure()
+
+def _draw_density(coords, point_colors, bins):
+    """Bin the points into an RGBA image buffer and draw it with imshow"""
+    x_min, y_min = coords.min(axis=0)
+    x_max, y_max = coords.max(axis=0)
+    x_span = max(x_max - x_min, 1e-12)
+    y_span = max(y_max - y_min, 1e-12)
+
+    col = np.minimum(((coords[:, 0] - x_min) / x_span * bins).astype(np.int64), bins - 1)
+    row = np.minimum(((coords[:, 1] - y_min) / y_span * bins).astype(np.int64), bins - 1)
+    pixel = row * bins + col
+
+    counts = np.bincount(pixel, minlength=bins * bins)
+    image = np.zeros((bins * bins, 4))
+    for channel in range(3):
+        image[:, channel] = np.bincount(pixel, weights=point_colors[:, channel], minlength=bins * bins)
+    occupied = counts > 0
+    image[occupied, :3] /= counts[occupied, None]
+    image[:, 3] = np.log1p(counts) / np.log1p(counts.max())
+
+    plt.imshow(image.reshape(bins, bins, 4), origin='lower', interpolation='nearest',
+               extent=(x_min, x_max, y_min, y_max), aspect='auto')
+
+def visualize_clusters_map(original_coords, cluster_labels, method_name, mode='auto',
+                           max_points=50000, random_state=42, pyramid=None, max_grid_cells=2000):
+    """Visualize clustering results on an interactive map
+
+    mode='markers' draws one CircleMarker per crash in a layer per cluster.
+    mode='aggregate' draws per-cluster centroid markers (sized by crash count)
+    and convex hulls, plus all raw points in one client-side marker-cluster
+    layer that shows counts at low zoom. mode='auto' uses 'markers' up to 2000
+    crashes. At most max_points randomly chosen crashes are written to the
+    point and heatmap layers, which keeps large maps small enough to open.
 
-def visualize_clusters_map(original_coords, cluster_labels, method_name):
-    """Visualize clustering results on an interactive map"""
-    mean_lat = original_coords.iloc[:, 1].mean()
-    mean_lon = original_coords.iloc[:, 0].mean()
+    With a grid pyramid (see grid_pyramid.py), the heatmap is drawn from the
+    cell counts of the finest level with at most max_points cells instead, so
+    it reflects every crash, and a layer of the finest level with at most
+    max_grid_cells cells shades each cell by its crash count.
+    """
+    coords = np.asarray(original_coords, dtype=np.float64)[:, :2]
+    cluster_labels = np.asarray(cluster_labels)
+    if mode == 'auto':
+        mode = 'markers' if len(coords) <= 2000 else 'aggregate'
+    if mode not in ('markers', 'aggregate'):
+        raise ValueError(f"Unknown map mode: {mode}")
+
+    mean_lat = coords[:, 1].mean()
+    mean_lon = coords[:, 0].mean()
 
     map_clusters = folium.Map(location=[mean_lat, mean_lon], zoom_start=12,
-                            tiles='CartoDB positron')
+                            tiles='CartoDB positron', prefer_canvas=True)
 
     unique_labels = np.unique(cluster_labels)
     num_clusters = len(unique_labels) - (1 if -1 in unique_labels else 0)
@@ -79,27 +137,127 @@ def visualize_clusters_map(original_coords, cluster_labels, method_name):
             color_dict[label] = mcolors.to_hex(colors[color_idx])
             color_idx += 1
 
-    for label in unique_labels:
-        fg = folium.FeatureGroup(name=f"Cluster {label}" if label != -1 else "Noise")
-        mask = cluster_labels == label
-        cluster_points = original_coords[mask]
-
-        for idx, point in cluster_points.iterrows():
-            folium.CircleMarker(
-                location=[point.iloc[1], point.iloc[0]],
-                radius=5,
-                color=color_dict[label],
-                fill=True,
-                fill_color=color_dict[label],
-                fill_opacity=0.7,
-                popup=f"Cluster: {label}"
-            ).add_to(fg)
-
-        fg.add_to(map_clusters)
+    # Point budget, shared by the raw point and heatmap layers
+    if len(coords) > max_points:
+        rng = np.random.default_rng(random_state)
+        sample = np.sort(rng.choice(len(coords), size=max_points, replace=False))
+        print(f"Map shows {max_points} of {len(coords)} crashes")
+    else:
+        sample = np.arange(len(coords))
+    # Five decimals (about 1 m) keeps the embedded coordinates short
+    sample_latlon = np.round(coords[sample][:, ::-1], 5)
+    sample_labels = cluster_labels[sample]
 
-    folium.LayerControl().add_to(map_clusters)
+    if mode == 'markers':
+        for label in unique_labels:
+            fg = folium.FeatureGroup(name=f"Cluster {label}" if label != -1 else "Noise")
+            for lat, lon in sample_latlon[sample_labels == label].tolist():
+                folium.CircleMarker(
+                    location=[lat, lon],
+                    radius=5,
+                    color=color_dict[label],
+                    fill=True,
+                    fill_color=color_dict[label],
+                    fill_opacity=0.7,
+                    popup=f"Cluster: {label}"
+                ).add_to(fg)
+            fg.add_to(map_clusters)
+    else:
+        _add_cluster_outlines(map_clusters, coords, cluster_labels, color_dict)
+        _add_point_cluster_layer(map_clusters, sample_latlon, sample_labels, color_dict)
 
-    heat_data = [[point.iloc[1], point.iloc[0]] for _, point in original_coords.iterrows()]
+    if pyramid is None:
+        heat_data = sample_latlon.tolist()
+    else:
+        level = pyramid['levels'][level_with_at_most(pyramid, max_points)]
+        heat_data = np.column_stack([np.round(level['lat'], 5), np.round(level['lon'], 5),
+                                     level['counts'][('count', '')].to_numpy()]).tolist()
+        _add_grid_layer(map_clusters, pyramid, level_with_at_most(pyramid, max_grid_cells))
     HeatMap(heat_data, radius=15).add_to(folium.FeatureGroup(name="Heatmap").add_to(map_clusters))
 
-    return map_clusters
\ No newline at end of file
+    folium.LayerControl().add_to(map_clusters)
+
+    return map_clusters
+
+def _add_cluster_outlines(map_clusters, coords, cluster_labels, color_dict):
+    """Add one layer with each cluster's convex hull and a centroid marker sized by its count"""
+    fg = folium.FeatureGroup(name="Cluster Outlines")
+
+    order = np.argsort(cluster_labels, kind='stable')
+    labels, starts, counts = np.unique(cluster_labels[order], return_index=True, return_counts=True)
+    # Noise is not drawn, so a large noise group must not shrink the cluster markers
+    max_count = counts[labels >= 0].max(initial=0)
+
+    for label, start, count in zip(labels, starts, counts):
+        if label == -1:
+            continue
+        points = coords[order[start:start + count]]
+        center_lon, center_lat = points.mean(axis=0)
+        color = color_dict[label]
+
+        if count >= 3:
+            try:
+                hull = ConvexHull(points)
+                folium.Polygon(
+                    locations=points[hull.vertices][:, ::-1].round(5).tolist(),
+                    color=color,
+                    weight=2,
+                    fill=True,
+                    fill_opacity=0.15
+                ).add_to(fg)
+            except QhullError:
+                pass  # All points collinear or identical
+
+        folium.CircleMarker(
+            location=[center_lat, center_lon],
+            radius=5 + 20 * np.sqrt(count / max_count),
+            color=color,
+            fill=True,
+            fill_color=color,
+            fill_opacity=0.8,
+            popup=f"Cluster {label}: {count} crashes"
+        ).add_to(fg)
+
+    fg.add_to(map_clusters)
+
+def _add_point_cluster_layer(map_clusters, latlon, labels, color_dict):
+    """Add the raw points as a marker-cluster layer built in the browser"""
+    palette = {int(label): color for label, color in color_dict.items()}
+    callback = f"""function (row) {{
+        var colors = {json.dumps(palette)};
+        var color = colors[row[2]];
+        var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+            {{radius: 5, color: color, fillColor: color, fillOpacity: 0.7}});
+        marker.bindPopup(row[2] == -1 ? 'Noise' : 'Cluster: ' + row[2]);
+        return marker;
+    }}"""
+    data = np.column_stack([latlon, labels]).tolist()
+    for row in data:
+        row[2] = int(row[2])
+    FastMarkerCluster(data, callback=callback, name="Crashes", chunkedLoading=True).add_to(map_clusters)
+
+def _add_grid_layer(map_clusters, pyramid, level_index):
+    """Add one GeoJSON layer of a pyramid level's cells, shaded by crash count"""
+    counts = pyramid['levels'][level_index]['counts']
+    totals = counts[('count', '')].to_numpy()
+    severe = np.zeros(len(counts), dtype=np.int64)
+    for severity in ('K', 'A'):
+        if ('Crash Severity', severity) in counts.columns:
+            severe += counts[('Crash Severity', severity)].to_numpy()
+    shades = plt.cm.YlOrRd(np.log1p(totals) / np.log1p(totals.max()))
+
+    features = [{
+        'type': 'Feature',
+        'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+        'properties': {'crashes': int(total), 'fatal_or_serious': int(n_severe), 'color': mcolors.to_hex(shade)},
+    } for ring, total, n_severe, shade in zip(cell_polygons(pyramid, level_index, counts.index), totals, severe, shades)]
+
+    cell_size = pyramid['levels'][level_index]['cell_size']
+    folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        name=f"Crash Grid ({cell_size:.0f} m)",
+        style_function=lambda feature: {'fillColor': feature['properties']['color'], 'color': 'none',
+                                        'fillOpacity': 0.5},
+        tooltip=folium.GeoJsonTooltip(fields=['crashes', 'fatal_or_serious'],
+                                      aliases=['Crashes', 'Fatal or serious (K+A)']),
+    ).add_to(map_clusters)
@@ -0,0 +1,207 @@
+import numpy as np
+from scipy import sparse
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.metrics.pairwise import euclidean_distances
+
+from instrumentation import traced
+
+# Bytes of pairwise distances held per chunk of silhouette queries
+CHUNK_BYTES = 256 * 2**20
+
+@traced()
+def cluster_quality(spatial_data, cluster_labels, silhouette='sampled', sample_size=10000,
+                    random_state=42, n_jobs=-1, sample_weight=None):
+    """Silhouette, Calinski-Harabasz and Davies-Bouldin scores for a clustering
+
+    silhouette='sampled' estimates the silhouette from sample_size points (with
+    a standard error), 'exact' computes it for every point in parallel chunks
+    and None skips it. sample_weight gives the crash counts of collapsed
+    locations, and every score is that of the crashes, each location counting
+    as that many points, without expanding the locations back into crashes.
+    Returns a dict of the scores.
+    """
+    scores = centroid_metrics(spatial_data, cluster_labels, sample_weight=sample_weight)
+
+    if silhouette == 'sampled':
+        scores['silhouette'], scores['silhouette_se'] = sampled_silhouette(
+            spatial_data, cluster_labels, sample_size=sample_size, random_state=random_state,
+            sample_weight=sample_weight
+        )
+    elif silhouette == 'exact':
+        scores['silhouette'] = exact_silhouette(spatial_data, cluster_labels, n_jobs=n_jobs,
+                                                sample_weight=sample_weight)
+        scores['silhouette_se'] = 0.0
+    elif silhouette is not None:
+        raise ValueError(f"Unknown silhouette mode: {silhouette}")
+
+    return scores
+
+def sampled_silhouette(spatial_data, cluster_labels, sample_size=10000, reference_size=1000,
+                       random_state=42, sample_weight=None):
+    """Mean silhouette over a random sample of points, and its standard error
+
+    Each sampled point's mean distance to a cluster is measured against up to
+    reference_size random points of that cluster, so the cost is
+    O(sample_size * k * reference_size) rather than O(n^2). The standard error
+    covers the sampling of the scored points. With sample_weight, points are
+    drawn (with replacement) in proportion to their weight, which samples the
+    crashes of collapsed locations without expanding them.
+    """
+    spatial_data = _as_matrix(spatial_data)
+    n_points = spatial_data.shape[0]
+    if n_points <= sample_size:
+        return exact_silhouette(spatial_data, cluster_labels, n_jobs=1, sample_weight=sample_weight), 0.0
+
+    rng = np.random.default_rng(random_state)
+    if sample_weight is None:
+        sample = rng.choice(n_points, size=sample_size, replace=False)
+        # Finite population correction
+        correction = np.sqrt(1 - sample_size / n_points)
+    else:
+        sample_weight = np.asarray(sample_weight, dtype=np.float64)
+        sample = rng.choice(n_points, size=sample_size, p=sample_weight / sample_weight.sum())
+        correction = 1.0
+    reference = _reference_sample(cluster_labels, reference_size, rng)
+    values = silhouette_values(spatial_data, cluster_labels, sample, reference, sample_weight=sample_weight)
+
+    se = values.std(ddof=1) / np.sqrt(sample_size) * correction
+    return float(values.mean()), float(se)
+
+def exact_silhouette(spatial_data, cluster_labels, n_jobs=-1, sample_weight=None):
+    """Mean silhouette over all points, computed in chunks across worker processes
+
+    With sample_weight the mean is weighted, as in silhouette_values.
+    """
+    spatial_data = _as_matrix(spatial_data)
+    n_points = spatial_data.shape[0]
+    # A few large jobs per worker; silhouette_values chunks each one to bound memory
+    n_parts = min(n_points, 4 * effective_n_jobs(n_jobs))
+    parts = np.array_split(np.arange(n_points), max(n_parts, 1))
+    values = Parallel(n_jobs=n_jobs)(
+        delayed(silhouette_values)(spatial_data, cluster_labels, part, sample_weight=sample_weight)
+        for part in parts
+    )
+    return float(np.average(np.concatenate(values), weights=sample_weight))
+
+def silhouette_values(spatial_data, cluster_labels, points, reference=None, sample_weight=None):
+    """Silhouette of the given points, with cluster distances measured against reference points
+
+    reference defaults to every point, which gives the exact silhouette.
+    spatial_data may be a sparse matrix; only the distance chunks are dense.
+    With sample_weight each point stands for that many coincident points, so
+    cluster distances are weighted means.
+    """
+    spatial_data = _as_matrix(spatial_data)
+    cluster_labels = np.asarray(cluster_labels)
+    _, codes = np.unique(cluster_labels, return_inverse=True)
+    n_clusters = codes.max() + 1
+    weights = np.ones(len(codes)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+    full_sizes = np.bincount(codes, weights=weights, minlength=n_clusters)
+    if reference is None:
+        reference = np.arange(spatial_data.shape[0])
+
+    # Sort the reference points by cluster so per-cluster distance sums are contiguous slices
+    reference = reference[np.argsort(codes[reference], kind='stable')]
+    ref_sizes = np.bincount(codes[reference], weights=weights[reference], minlength=n_clusters)
+    ref_counts = np.bincount(codes[reference], minlength=n_clusters)
+    ref_weights = weights[reference]
+    ref_data = spatial_data[reference]
+    starts = np.concatenate([[0], np.cumsum(ref_counts)[:-1]])
+    in_reference = np.zeros(spatial_data.shape[0], dtype=bool)
+    in_reference[reference] = True
+
+    values = []
+    chunk_rows = _chunk_rows(ref_data)
+    for start in range(0, len(points), chunk_rows):
+        chunk = points[start:start + chunk_rows]
+        distances = euclidean_distances(spatial_data[chunk], ref_data) * ref_weights
+        cluster_sums = np.add.reduceat(distances, starts, axis=1)
+
+        own = codes[chunk]
+        rows = np.arange(len(chunk))
+        # A point's zero distance to itself (one unit of its weight) does not count towards its own cluster
+        own_count = ref_sizes[own] - in_reference[chunk]
+        a = cluster_sums[rows, own] / np.where(own_count > 0, own_count, 1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_other = cluster_sums / ref_sizes
+        mean_other[rows, own] = np.inf
+        b = mean_other.min(axis=1)
+
+        s = (b - a) / np.maximum(a, b)
+        # Singletons score 0, as in sklearn
+        s[full_sizes[own] <= 1] = 0
+        values.append(s)
+
+    return np.concatenate(values) if values else np.zeros(0)
+
+def _reference_sample(cluster_labels, reference_size, rng):
+    """Up to reference_size random points from each cluster"""
+    _, codes = np.unique(cluster_labels, return_inverse=True)
+    order = np.lexsort((rng.random(len(codes)), codes))
+    sorted_codes = codes[order]
+    starts = np.searchsorted(sorted_codes, sorted_codes, side='left')
+    rank = np.arange(len(codes)) - starts
+    return order[rank < reference_size]
+
+def centroid_metrics(spatial_data, cluster_labels, sample_weight=None):
+    """Calinski-Harabasz and Davies-Bouldin indices from cluster centroids and sums
+
+    Both need only per-cluster counts, sums and centroid distances, so they
+    cost one O(n) pass plus O(k^2) work. Sparse input is never densified.
+    sample_weight makes the counts, centroids and dispersions weighted, as if
+    each point were repeated that many times.
+    """
+    spatial_data = _as_matrix(spatial_data)
+    _, codes = np.unique(cluster_labels, return_inverse=True)
+    n_rows = spatial_data.shape[0]
+    weights = np.ones(n_rows) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+    n_points = weights.sum()
+    sizes = np.bincount(codes, weights=weights)
+    n_clusters = len(sizes)
+    if n_clusters < 2 or n_clusters >= n_points:
+        return {'calinski_harabasz': np.nan, 'davies_bouldin': np.nan}
+
+    if sparse.issparse(spatial_data):
+        spatial_data = spatial_data.astype(np.float64)
+        indicator = sparse.csr_matrix((weights, (codes, np.arange(n_rows))), shape=(n_clusters, n_rows))
+        centroids = (indicator @ spatial_data).toarray() / sizes[:, None]
+        mean = np.asarray(spatial_data.T @ weights).ravel() / n_points
+
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, with |x|^2 and x.c summed over the stored entries
+        rows = np.repeat(np.arange(n_rows), np.diff(spatial_data.indptr))
+        values = spatial_data.data
+        sq_norms = np.bincount(rows, weights=values ** 2, minlength=n_rows)
+        dots = np.bincount(rows, weights=values * centroids[codes[rows], spatial_data.indices], minlength=n_rows)
+        sq_dist = np.maximum(sq_norms - 2 * dots + np.sum(centroids ** 2, axis=1)[codes], 0)
+    else:
+        spatial_data = spatial_data.astype(np.float64, copy=False)
+        sums = np.stack([np.bincount(codes, weights=weights * spatial_data[:, dim], minlength=n_clusters)
+                         for dim in range(spatial_data.shape[1])], axis=1)
+        centroids = sums / sizes[:, None]
+        mean = weights @ spatial_data / n_points
+
+        offsets = spatial_data - centroids[codes]
+        sq_dist = np.einsum('ij,ij->i', offsets, offsets)
+    within = weights @ sq_dist
+    between = np.sum(sizes * np.sum((centroids - mean) ** 2, axis=1))
+    calinski = 1.0 if within == 0 else between * (n_points - n_clusters) / (within * (n_clusters - 1))
+
+    scatter = np.bincount(codes, weights=weights * np.sqrt(sq_dist), minlength=n_clusters) / sizes
+    centroid_dist = euclidean_distances(centroids)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = (scatter[:, None] + scatter[None, :]) / centroid_dist
+    ratios[~np.isfinite(ratios)] = 0
+    np.fill_diagonal(ratios, 0)
+    davies = 0.0 if np.allclose(scatter, 0) or np.allclose(centroid_dist, 0) else float(np.mean(ratios.max(axis=1)))
+
+    return {'calinski_harabasz': float(calinski), 'davies_bouldin': davies}
+
+def _chunk_rows(spatial_data):
+    return max(1, CHUNK_BYTES // (8 * max(spatial_data.shape[0], 1)))
+
+def _as_matrix(spatial_data):
+    # Sparse input stays sparse (as CSR, for fast row selection); the rest becomes an array
+    if sparse.issparse(spatial_data):
+        return sparse.csr_matrix(spatial_data)
+    return np.asarray(spatial_data)
@@ -0,0 +1,197 @@
+import argparse
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from threadpoolctl import threadpool_limits
+
+from load_data import load_data
+from data_cleaning import GEO_FEATURES, def_geo_features, get_spatial_data
+from db_scan import dbscan_clustering, find_optimal_eps
+from grid_dbscan import GridDBSCAN
+from k_means import find_optimal_k, kmeans_clustering
+from instrumentation import stage, start_trace, stop_trace, tracing, add_records
+
+# Below this mean Jaccard a cluster is usually considered dissolved (Hennig, 2007)
+DISSOLVED_JACCARD = 0.5
+
+def bootstrap_stability(spatial_data, reference_labels, method='kmeans', n_resamples=100, scheme='subsample',
+                        sample_fraction=0.8, eps=None, min_samples=5, random_state=42, max_workers=None):
+    """Stability of a clustering under B resampled refits, run in a process pool
+
+    Each resample draws sample_fraction of the points without replacement
+    (scheme='subsample') or n points with replacement (scheme='bootstrap',
+    where repeat draws become sample_weight), refits KMeans with the
+    reference's number of clusters or GridDBSCAN with eps and min_samples,
+    and matches every reference cluster to its best-overlapping refit cluster.
+
+    The workers read spatial_data and reference_labels from memory-mapped .npy
+    files (on /dev/shm where available) instead of receiving pickled copies.
+    Returns a dict with 'clusters', a DataFrame of each reference cluster's
+    mean Jaccard similarity to its match and the share of resamples in which
+    it dissolved, and 'confidence', the share of the resamples holding each
+    point in which it was co-assigned with its reference cluster (for noise,
+    in which it stayed noise).
+    """
+    spatial_data = np.ascontiguousarray(spatial_data, dtype=np.float64)
+    reference_labels = np.asarray(reference_labels, dtype=np.int64)
+    options = {
+        'method': method,
+        'scheme': scheme,
+        'sample_fraction': sample_fraction,
+        'n_clusters': int(reference_labels.max()) + 1,
+        'eps': eps,
+        'min_samples': min_samples,
+    }
+    if method not in ('kmeans', 'dbscan'):
+        raise ValueError(f"Unknown clustering method: {method}")
+    if method == 'dbscan' and eps is None:
+        raise ValueError("DBSCAN refits need the eps of the reference clustering")
+
+    if max_workers is None:
+        max_workers = min(n_resamples, os.cpu_count() or 1)
+    n_threads = max(1, (os.cpu_count() or 1) // max_workers)
+    seeds = np.random.SeedSequence(random_state).spawn(n_resamples)
+    batches = [batch for batch in np.array_split(np.arange(n_resamples), max_workers) if len(batch)]
+
+    shared_dir = tempfile.mkdtemp(prefix='stability-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    try:
+        coords_path = os.path.join(shared_dir, 'coords.npy')
+        labels_path = os.path.join(shared_dir, 'labels.npy')
+        np.save(coords_path, spatial_data)
+        np.save(labels_path, reference_labels)
+
+        with stage('bootstrap_stability', rows_in=len(spatial_data)), \
+                ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_refit_worker, coords_path, labels_path, [seeds[i] for i in batch], options,
+                                n_threads, tracing())
+                for batch in batches
+            ]
+            results = [future.result() for future in futures]
+            for result in results:
+                add_records(result.pop('trace'))
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+    jaccard = np.concatenate([result['jaccard'] for result in results])
+    agree = np.sum([result['agree'] for result in results], axis=0)
+    seen = np.sum([result['seen'] for result in results], axis=0)
+
+    clusters = np.arange(options['n_clusters'])
+    sizes = np.bincount(reference_labels[reference_labels >= 0], minlength=len(clusters))
+    point_confidence = np.divide(agree, seen, out=np.full(len(seen), np.nan), where=seen > 0)
+    cluster_table = pd.DataFrame({
+        'cluster': clusters,
+        'size': sizes,
+        'mean_jaccard': jaccard.mean(axis=0),
+        'jaccard_se': jaccard.std(axis=0, ddof=1) / np.sqrt(len(jaccard)) if len(jaccard) > 1 else np.nan,
+        'dissolved_share': (jaccard < DISSOLVED_JACCARD).mean(axis=0),
+        'mean_confidence': pd.Series(point_confidence[reference_labels >= 0])
+                             .groupby(reference_labels[reference_labels >= 0]).mean()
+                             .reindex(clusters).to_numpy(),
+    })
+
+    return {'clusters': cluster_table, 'confidence': point_confidence, 'n_resamples': len(jaccard)}
+
+def _refit_worker(coords_path, labels_path, seeds, options, n_threads, trace=False):
+    # Opened read-only as memory maps, so every worker shares the one copy in the page cache
+    spatial_data = np.load(coords_path, mmap_mode='r')
+    reference_labels = np.load(labels_path, mmap_mode='r')
+    if trace:
+        start_trace()
+
+    n_points = len(spatial_data)
+    jaccard = np.zeros((len(seeds), options['n_clusters']), dtype=np.float32)
+    agree = np.zeros(n_points, dtype=np.int32)
+    seen = np.zeros(n_points, dtype=np.int32)
+    with threadpool_limits(limits=n_threads), stage(f"refits x{len(seeds)}", rows_in=n_points):
+        for row, seed in enumerate(seeds):
+            sample, weights = _draw_sample(n_points, options, np.random.default_rng(seed))
+            labels = _refit(spatial_data[sample], weights, options, seed)
+            jaccard[row], agree_sample = _match_reference(reference_labels[sample], labels, options['n_clusters'])
+            agree[sample] += agree_sample
+            seen[sample] += 1
+
+    return {'jaccard': jaccard, 'agree': agree, 'seen': seen, 'trace': stop_trace() if trace else []}
+
+def _draw_sample(n_points, options, rng):
+    """Sorted indices of the drawn points, and their draw counts for a bootstrap"""
+    if options['scheme'] == 'subsample':
+        size = int(round(options['sample_fraction'] * n_points))
+        return np.sort(rng.choice(n_points, size=size, replace=False)), None
+    if options['scheme'] == 'bootstrap':
+        counts = np.bincount(rng.integers(0, n_points, size=n_points), minlength=n_points)
+        sample = np.flatnonzero(counts)
+        return sample, counts[sample].astype(np.float64)
+    raise ValueError(f"Unknown resampling scheme: {options['scheme']}")
+
+def _refit(coords, weights, options, seed):
+    if options['method'] == 'kmeans':
+        kmeans = KMeans(n_clusters=options['n_clusters'], random_state=seed.generate_state(1)[0], n_init=3)
+        return kmeans.fit_predict(coords, sample_weight=weights)
+    dbscan = GridDBSCAN(eps=options['eps'], min_samples=options['min_samples'])
+    return dbscan.fit_predict(coords, sample_weight=weights)
+
+def _match_reference(reference, labels, n_reference):
+    """Best Jaccard of each reference cluster among the refit clusters, and which points kept theirs
+
+    A point agrees when the refit put it in the cluster that best matches its
+    reference cluster, or when it is reference noise and stayed noise.
+    """
+    n_refit = int(labels.max()) + 1 if len(labels) else 0
+    # Row/column 0 is noise
+    table = np.bincount((reference + 1) * (n_refit + 1) + (labels + 1),
+                        minlength=(n_reference + 1) * (n_refit + 1)).reshape(n_reference + 1, n_refit + 1)
+    clustered = table[1:, 1:]
+    union = table[1:].sum(axis=1)[:, None] + table[:, 1:].sum(axis=0)[None, :] - clustered
+    jaccard = np.divide(clustered, union, out=np.zeros(clustered.shape), where=union > 0)
+
+    if n_refit:
+        best = np.argmax(jaccard, axis=1)
+        best_jaccard = jaccard[np.arange(n_reference), best]
+    else:
+        best = np.zeros(n_reference, dtype=np.int64)
+        best_jaccard = np.zeros(n_reference)
+
+    # Clusters with nothing in common with any refit cluster have no match to agree with
+    match = np.where(best_jaccard > 0, best, -2)
+    expected = np.where(reference >= 0, match[np.maximum(reference, 0)], -1)
+    return best_jaccard, expected == labels
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bootstrap stability of the DBSCAN and KMeans crash clusterings")
+    parser.add_argument('--years', type=int, nargs='+', default=[2024, 2025])
+    parser.add_argument('--method', choices=['kmeans', 'dbscan'], nargs='+', default=['kmeans', 'dbscan'])
+    parser.add_argument('--n-resamples', type=int, default=100)
+    parser.add_argument('--scheme', choices=['subsample', 'bootstrap'], default='subsample')
+    parser.add_argument('--sample-fraction', type=float, default=0.8)
+    parser.add_argument('--coords', choices=['scaled', 'projected'], default='scaled')
+    parser.add_argument('--min-samples', type=int, default=5)
+    parser.add_argument('--max-workers', type=int)
+    args = parser.parse_args()
+
+    crash_data = load_data(columns=GEO_FEATURES, filters={'Crash Year': args.years})
+    crash_data_geo = def_geo_features(crash_data)
+    _, scaled_coords, _, _ = get_spatial_data(crash_data_geo, coords=args.coords)
+
+    for method in args.method:
+        eps = None
+        if method == 'kmeans':
+            _, labels = kmeans_clustering(scaled_coords, n_clusters=find_optimal_k(scaled_coords))
+        else:
+            eps = find_optimal_eps(scaled_coords, args.min_samples)
+            _, labels = dbscan_clustering(scaled_coords, eps=eps, min_samples=args.min_samples, algorithm='grid')
+
+        stability = bootstrap_stability(scaled_coords, labels, method=method, n_resamples=args.n_resamples,
+                                        scheme=args.scheme, sample_fraction=args.sample_fraction, eps=eps,
+                                        min_samples=args.min_samples, max_workers=args.max_workers)
+        confidence = stability['confidence']
+        print(f"\n{method} stability over {stability['n_resamples']} {args.scheme} refits:")
+        print(stability['clusters'].to_string(index=False, float_format='{:.3f}'.format))
+        print(f"Point co-assignment confidence: median {np.nanmedian(confidence):.3f}, "
+              f"{np.nanmean(confidence < 0.8):.1%} of points below 0.8")
@@ -1,89 +1,189 @@
 import numpy as np
-from scipy.spatial.distance import cdist
+import pandas as pd
 import matplotlib.pyplot as plt
-
-def analyze_clusters(crash_data_geo, cluster_labels):
-    """Analyze the characteristics of each cluster"""
-    cluster_df = crash_data_geo.copy()
-    cluster_df['cluster'] = cluster_labels
-
-    cluster_stats = {}
-
-    unique_clusters = np.unique(cluster_labels)
-
-    for cluster in unique_clusters:
-        if cluster == -1:
+from data_cleaning import SEVERITY_LEVELS
+from projection import VirginiaLambert
+from hotspot_index import query_hotspots
+from report import show_figure
+
+SUMMARY_COLUMNS = ['size', 'center_x', 'center_y', 'radius', 'radius_m']
+
+def cluster_summary(crash_data_geo, cluster_labels):
+    """Per-cluster size, center, mean radius and categorical counts in one grouped pass
+
+    Returns a DataFrame indexed by cluster (noise excluded). The SUMMARY_COLUMNS
+    come first; each categorical column then contributes one count column per
+    category, under a (column, category) MultiIndex. radius is the mean
+    distance to the center in degrees, radius_m the same in meters (measured
+    in Virginia Lambert coordinates).
+    """
+    cluster_labels = np.asarray(cluster_labels)
+    keep = cluster_labels != -1
+    clusters, codes = np.unique(cluster_labels[keep], return_inverse=True)
+    n_clusters = len(clusters)
+
+    size = np.bincount(codes, minlength=n_clusters)
+    x = crash_data_geo['x'].to_numpy()[keep]
+    y = crash_data_geo['y'].to_numpy()[keep]
+    with np.errstate(invalid='ignore'):
+        center_x = np.bincount(codes, weights=x, minlength=n_clusters) / size
+        center_y = np.bincount(codes, weights=y, minlength=n_clusters) / size
+        distances = np.hypot(x - center_x[codes], y - center_y[codes])
+        radius = np.bincount(codes, weights=distances, minlength=n_clusters) / size
+        xy_m = VirginiaLambert().transform(np.column_stack([x, y]))
+        center_m = np.column_stack([np.bincount(codes, weights=xy_m[:, dim], minlength=n_clusters) / size
+                                    for dim in range(2)])
+        distances_m = np.hypot(*(xy_m - center_m[codes]).T)
+        radius_m = np.bincount(codes, weights=distances_m, minlength=n_clusters) / size
+    radius[size <= 1] = 0
+    radius_m[size <= 1] = 0
+
+    parts = {
+        ('size', ''): size,
+        ('center_x', ''): center_x,
+        ('center_y', ''): center_y,
+        ('radius', ''): radius,
+        ('radius_m', ''): radius_m,
+    }
+    parts.update(category_counts(crash_data_geo, codes, n_clusters, keep))
+
+    summary = pd.DataFrame(parts, index=pd.Index(clusters, name='cluster'))
+    summary.columns = pd.MultiIndex.from_tuples(summary.columns)
+    return summary
+
+def category_counts(crash_data_geo, codes, n_groups, keep=None):
+    """Per-group counts of every category of each categorical column
+
+    codes gives the group (0 to n_groups - 1) of each row selected by the
+    boolean mask keep (every row if None). Returns a dict of (column, category)
+    to an array of counts per group.
+    """
+    if keep is None:
+        keep = np.ones(len(crash_data_geo), dtype=bool)
+
+    parts = {}
+    for col in crash_data_geo.columns:
+        if col in ['x', 'y', 'cluster']:
+            continue
+        series = crash_data_geo[col]
+        if series.dtype.name not in ['object', 'category']:
             continue
 
-        cluster_data = cluster_df[cluster_df['cluster'] == cluster]
-        cluster_size = len(cluster_data)
-
-        center_x = cluster_data['x'].mean()
-        center_y = cluster_data['y'].mean()
-
-        if cluster_size > 1:
-            points = cluster_data[['x', 'y']].values
-            center = np.array([[center_x, center_y]])
-            distances = cdist(points, center, 'euclidean')
-            radius = distances.mean()
+        if series.dtype.name == 'category':
+            category_codes = series.cat.codes.to_numpy()[keep]
+            categories = series.cat.categories
         else:
-            radius = 0
+            category_codes, categories = pd.factorize(series.to_numpy()[keep])
+
+        # Missing values are left out, as in value_counts()
+        valid = category_codes >= 0
+        n_categories = len(categories)
+        counts = np.bincount(codes[valid] * n_categories + category_codes[valid],
+                             minlength=n_groups * n_categories).reshape(n_groups, n_categories)
+        for j, category in enumerate(categories):
+            parts[(col, category)] = counts[:, j]
+    return parts
+
+def grid_cluster_summary(pyramid, index, method='dbscan', level=0):
+    """cluster_summary computed from a grid pyramid level instead of the crashes
+
+    Each cell is assigned to a hotspot of the saved hotspot index by its
+    center, and its counts go to that cluster. Centers and radii are
+    count-weighted over the cell centers, so everything is exact up to the
+    cell width of the level.
+    """
+    level = pyramid['levels'][level]
+    cell_coords = np.column_stack([level['lon'], level['lat']])
+    cell_labels = query_hotspots(index, cell_coords, method=method)['cluster'].to_numpy()
+    keep = cell_labels != -1
+    clusters, codes = np.unique(cell_labels[keep], return_inverse=True)
+    n_clusters = len(clusters)
+
+    counts = level['counts'][keep]
+    weights = counts[('count', '')].to_numpy(dtype=np.float64)
+    size = np.bincount(codes, weights=weights, minlength=n_clusters)
+    x, y = cell_coords[keep].T
+    xy_m = pyramid['projection'].transform(cell_coords[keep])
+    with np.errstate(invalid='ignore'):
+        center_x = np.bincount(codes, weights=weights * x, minlength=n_clusters) / size
+        center_y = np.bincount(codes, weights=weights * y, minlength=n_clusters) / size
+        center_m = np.column_stack([np.bincount(codes, weights=weights * xy_m[:, dim], minlength=n_clusters) / size
+                                    for dim in range(2)])
+        distances = np.hypot(x - center_x[codes], y - center_y[codes])
+        radius = np.bincount(codes, weights=weights * distances, minlength=n_clusters) / size
+        distances_m = np.hypot(*(xy_m - center_m[codes]).T)
+        radius_m = np.bincount(codes, weights=weights * distances_m, minlength=n_clusters) / size
+
+    summary = pd.DataFrame({
+        ('size', ''): size.astype(np.int64),
+        ('center_x', ''): center_x,
+        ('center_y', ''): center_y,
+        ('radius', ''): radius,
+        ('radius_m', ''): radius_m,
+    }, index=pd.Index(clusters, name='cluster'))
+    category_sums = counts.drop(columns='count', level=0).groupby(codes).sum()
+    category_sums.index = summary.index
+    summary = pd.concat([summary, category_sums], axis=1)
+    summary.columns = pd.MultiIndex.from_tuples(summary.columns)
+    return summary
+
+def cluster_stats_from_summary(summary):
+    """Convert a cluster_summary DataFrame to the per-cluster dict returned by analyze_clusters"""
+    count_columns = [col for col in summary.columns.get_level_values(0).unique()
+                     if col not in SUMMARY_COLUMNS]
 
-        severity_counts = None
-        if 'Crash Severity' in cluster_data.columns:
-            severity_counts = cluster_data['Crash Severity'].value_counts().to_dict()
-
-        cluster_stats[cluster] = {
-            'size': cluster_size,
-            'center': (center_x, center_y),
-            'radius': radius,
-            'severity_counts': severity_counts
+    cluster_stats = {}
+    for cluster, row in summary.iterrows():
+        stats = {
+            'size': int(row[('size', '')]),
+            'center': (row[('center_x', '')], row[('center_y', '')]),
+            'radius': row[('radius', '')],
+            'radius_m': row[('radius_m', '')],
+            'severity_counts': None
         }
-
-        for col in cluster_data.columns:
-            if col in ['x', 'y', 'cluster']:
-                continue
-
-            if cluster_data[col].dtype.name in ['object', 'category']:
-                cluster_stats[cluster][f'{col}_counts'] = cluster_data[col].value_counts().to_dict()
+        for col in count_columns:
+            counts = row[col]
+            counts = counts[counts > 0].sort_values(ascending=False, kind='stable')
+            stats[f'{col}_counts'] = counts.astype(int).to_dict()
+        if 'Crash Severity' in count_columns:
+            stats['severity_counts'] = stats['Crash Severity_counts']
+        cluster_stats[cluster] = stats
 
     return cluster_stats
 
-def visualize_cluster_properties(crash_data_geo, cluster_labels):
-    """Visualize properties of clusters"""
-    cluster_df = crash_data_geo.copy()
-    cluster_df['cluster'] = cluster_labels
-
-    if -1 in cluster_labels:
-        cluster_df_filtered = cluster_df[cluster_df['cluster'] != -1]
-    else:
-        cluster_df_filtered = cluster_df
-
-    if len(np.unique(cluster_df_filtered['cluster'])) > 0:
+def analyze_clusters(crash_data_geo, cluster_labels):
+    """Analyze the characteristics of each cluster"""
+    return cluster_stats_from_summary(cluster_summary(crash_data_geo, cluster_labels))
+
+def visualize_cluster_properties(crash_data_geo=None, cluster_labels=None, summary=None):
+    """Visualize properties of clusters
+
+    Plots from cluster_summary's grouped counts, so the crash table is never
+    copied or given a cluster column. A precomputed summary (for instance
+    grid_cluster_summary from a grid pyramid) can be passed instead of the
+    crashes and their labels.
+    """
+    if summary is None:
+        summary = cluster_summary(crash_data_geo, cluster_labels)
+    count_columns = [col for col in summary.columns.get_level_values(0).unique()
+                     if col not in SUMMARY_COLUMNS]
+
+    if len(summary) > 0:
         plt.figure(figsize=(12, 6))
-        cluster_sizes = cluster_df_filtered['cluster'].value_counts().sort_index()
+        cluster_sizes = summary[('size', '')]
         cluster_sizes.plot(kind='bar', color='skyblue')
         plt.title('Number of Crashes per Cluster', fontsize=16)
         plt.xlabel('Cluster ID', fontsize=14)
         plt.ylabel('Number of Crashes', fontsize=14)
         plt.grid(axis='y', alpha=0.3)
         plt.tight_layout()
-        plt.show()
+        show_figure()
 
-        if 'Crash Severity' in crash_data_geo.columns:
+        if 'Crash Severity' in count_columns:
             plt.figure(figsize=(14, 8))
-            severity_order = ['K', 'A', 'B', 'C', 'O']
-
-            severity_pivot = pd.crosstab(
-                cluster_df_filtered['cluster'],
-                cluster_df_filtered['Crash Severity']
-            )
-
-            for sev in severity_order:
-                if sev not in severity_pivot.columns:
-                    severity_pivot[sev] = 0
 
-            severity_pivot = severity_pivot[severity_order]
+            severity_pivot = summary['Crash Severity'].reindex(columns=SEVERITY_LEVELS, fill_value=0)
+            severity_pivot.columns.name = 'Crash Severity'
 
             severity_pivot_pct = severity_pivot.div(severity_pivot.sum(axis=1), axis=0) * 100
 
@@ -101,15 +201,14 @@ def visualize_cluster_properties(crash_data_geo, cluster_labels):
             plt.legend(title='Severity', title_fontsize=12)
             plt.grid(axis='y', alpha=0.3)
             plt.tight_layout()
-            plt.show()
+            show_figure()
 
-        cat_columns = [col for col in crash_data_geo.select_dtypes(include=['object', 'category']).columns
-                      if col != 'Crash Severity']
+        cat_columns = [col for col in count_columns if col != 'Crash Severity']
 
         for col in cat_columns[:3]:
             plt.figure(figsize=(15, 8))
 
-            clusters = sorted(cluster_df_filtered['cluster'].unique())
+            clusters = summary.index.tolist()
 
             for i, cluster_id in enumerate(clusters):
                 if len(clusters) <= 3:
@@ -117,8 +216,8 @@ def visualize_cluster_properties(crash_data_geo, cluster_labels):
                 else:
                     plt.subplot(2, (len(clusters)+1)//2, i+1)
 
-                cluster_data = cluster_df_filtered[cluster_df_filtered['cluster'] == cluster_id]
-                top_cats = cluster_data[col].value_counts().nlargest(5)
+                counts = summary.loc[cluster_id, col]
+                top_cats = counts[counts > 0].nlargest(5)
 
                 top_cats.plot(kind='barh', color='skyblue')
 
@@ -128,4 +227,4 @@ def visualize_cluster_properties(crash_data_geo, cluster_labels):
 
             plt.suptitle(f'Top {col} Categories by Cluster', fontsize=16)
             plt.tight_layout(rect=[0, 0, 1, 0.96])
-            plt.show()
\ No newline at end of file
+            show_figure()
\ No newline at end of file
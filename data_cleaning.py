@@ -4,11 +4,20 @@ from sklearn.impute import SimpleImputer
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
 import numpy as np
+import pandas as pd
+from scipy import sparse
 
-def def_geo_features(crash_data, geo_features = ["Crash Severity", "Light Condition", "Roadway Surface Condition", "Relation To Roadway",
-                            "Roadway Alignment", "Roadway Surface Type", "Roadway Defect", "Intersection Type",
-                            "Traffic Control Type", "Max Speed Diff",
-                            "RoadDeparture Type", "Intersection Analysis", "x", "y"]):    
+from projection import VirginiaLambert
+
+GEO_FEATURES = ["Crash Severity", "Light Condition", "Roadway Surface Condition", "Relation To Roadway",
+                "Roadway Alignment", "Roadway Surface Type", "Roadway Defect", "Intersection Type",
+                "Traffic Control Type", "Max Speed Diff",
+                "RoadDeparture Type", "Intersection Analysis", "x", "y"]
+
+# KABCO, most to least severe
+SEVERITY_LEVELS = ['K', 'A', 'B', 'C', 'O']
+
+def def_geo_features(crash_data, geo_features=GEO_FEATURES):
     # Taking a look at the columns to see which ones might be the most helpful
     all_columns = crash_data.columns.tolist()
     for col in all_columns:
@@ -19,10 +28,66 @@ def def_geo_features(crash_data, geo_features = ["Crash Severity", "Light Condit
     if crash_data_geo['x'].isnull().any() or crash_data_geo['y'].isnull().any():
             print("Removing entries with missing spatial coordinates")
             crash_data_geo = crash_data_geo.dropna(subset=['x', 'y'])
-    
+
+    crash_data_geo = compact_crash_table(crash_data_geo)
+    print(f"Crash table: {crash_data_geo.memory_usage(deep=True).sum() / 2**20:.1f} MB")
+
     return crash_data_geo
 
-def pipline(crash_data_geo):
+def compact_crash_table(crash_data, categories=None):
+    """The crash rows with compact column types
+
+    String and categorical columns become categoricals (int8 codes for Crash
+    Severity and the condition columns), x/y become float32 and integer
+    columns are downcast. A column's categories are those given for it in
+    categories (column -> list of values, e.g. from table_categories of an
+    earlier table) followed by any values not in it, so tables built with the
+    same dictionaries share their codes; otherwise they are the column's own
+    sorted values. Cluster labels are kept as a separate array next to the
+    table, never added to it.
+    """
+    categories = categories or {}
+    columns = {}
+    for col in crash_data.columns:
+        series = crash_data[col]
+        if series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype):
+            columns[col] = pd.Categorical(series, dtype=_category_dtype(col, series, categories.get(col, [])))
+        elif col in ('x', 'y'):
+            columns[col] = series.to_numpy(dtype=np.float32)
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            columns[col] = pd.to_numeric(series, downcast='integer').to_numpy()
+        else:
+            columns[col] = series.to_numpy()
+
+    return pd.DataFrame(columns, index=crash_data.index)
+
+def table_categories(crash_data):
+    """Category lists of a compact table's categorical columns, for compact_crash_table"""
+    return {col: list(crash_data[col].cat.categories) for col in crash_data.columns
+            if isinstance(crash_data[col].dtype, pd.CategoricalDtype)}
+
+def _category_dtype(col, series, known):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        values = series.cat.categories
+    else:
+        values = pd.unique(series.dropna().to_numpy())
+
+    known = list(known)
+    new = sorted(set(values) - set(known), key=str)
+    if col == 'Crash Severity':
+        # Keep the KABCO order, with any unexpected codes after it
+        levels = SEVERITY_LEVELS + [v for v in known + new if v not in SEVERITY_LEVELS]
+        return pd.CategoricalDtype(levels, ordered=True)
+    return pd.CategoricalDtype(known + new)
+
+def pipline(crash_data_geo, min_frequency=0.001):
+    """Encode the geo features into a sparse CSR float32 matrix
+
+    Categories seen in less than min_frequency of the rows are merged into one
+    infrequent column per feature (unseen ones map to it too), so rare
+    condition codes don't each add a column. Prints the memory taken by each
+    block of the output.
+    """
     # Categorical and numeric data separation
     crash_data_num = crash_data_geo.select_dtypes(include=[np.number]).columns.tolist()
     crash_data_cat = crash_data_geo.select_dtypes(exclude=[np.number]).columns.tolist()
@@ -40,16 +105,37 @@ def pipline(crash_data_geo):
 
     full_pipeline = ColumnTransformer([
         ("num", num_pipeline, crash_data_num),
-        ("sev", OrdinalEncoder(), crash_sev),
-        ("cat", OneHotEncoder(handle_unknown="ignore"), other_cat_data) # Avoids issues with unseen categories?
-    ])
+        ("sev", OrdinalEncoder(dtype=np.float32), crash_sev),
+        ("cat", OneHotEncoder(handle_unknown="infrequent_if_exist", min_frequency=min_frequency,
+                              sparse_output=True, dtype=np.float32), other_cat_data)
+    ], sparse_threshold=1.0) # Stay sparse however dense the one-hot block is
 
-    processed_crash_data = full_pipeline.fit_transform(crash_data_geo)
+    processed_crash_data = sparse.csr_matrix(full_pipeline.fit_transform(crash_data_geo), dtype=np.float32)
     print(processed_crash_data.shape)  # Check transformed data shape
 
+    input_mb = crash_data_geo.memory_usage(deep=True).sum() / 2**20
+    print(f"Input features: {input_mb:.1f} MB")
+    for name, block in full_pipeline.output_indices_.items():
+        if block.stop > block.start:
+            print(f"- {name}: {block.stop - block.start} columns, "
+                  f"{sparse_nbytes(processed_crash_data[:, block]) / 2**20:.1f} MB")
+    dense_mb = processed_crash_data.shape[0] * processed_crash_data.shape[1] * 8 / 2**20
+    print(f"Encoded features: {sparse_nbytes(processed_crash_data) / 2**20:.1f} MB as CSR float32 "
+          f"({dense_mb:.1f} MB dense float64)")
+
     return processed_crash_data
 
-def get_spatial_data(crash_data_geo):
+def sparse_nbytes(matrix):
+    """Bytes held by a CSR/CSC matrix's data and index arrays"""
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+def get_spatial_data(crash_data_geo, coords='scaled'):
+    """Numeric column names, clustering coordinates, lon/lat and the fitted coordinate transform
+
+    coords='scaled' standardizes lon/lat with a StandardScaler (unitless).
+    coords='projected' projects them to Virginia Lambert meters, so eps,
+    KMeans inertia and neighbor distances downstream are all in meters.
+    """
     # Spatial Data
     numeric_columns = crash_data_geo.select_dtypes(include=[np.number]).columns.tolist()
     
@@ -64,9 +150,36 @@ def get_spatial_data(crash_data_geo):
     if spatial_coords.isnull().any().any():
         spatial_coords = spatial_coords.dropna()
 
-    scaler = StandardScaler()
+    if coords == 'scaled':
+        scaler = StandardScaler()
+    elif coords == 'projected':
+        scaler = VirginiaLambert()
+    else:
+        raise ValueError(f"Unknown coordinate mode: {coords}")
     scaled_coords = scaler.fit_transform(spatial_coords)
 
     return spatial_data, scaled_coords, spatial_coords, scaler
 
-
+def collapse_locations(coords, grid_size=None):
+    """Collapse points onto their unique locations, or onto grid cells of side grid_size
+
+    Returns the locations, the number of points at each (to pass as
+    sample_weight) and the index map from every point to its location, so
+    labels[index_map] expands per-location labels back to the points. On a
+    grid, each cell's location is the mean of its points; grid_size is in the
+    units of coords (e.g. meters for projected coordinates).
+    """
+    coords = np.asarray(coords)
+    keys = coords if grid_size is None else np.floor(coords / grid_size)
+    unique_keys, index_map, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    index_map = index_map.ravel()
+
+    if grid_size is None:
+        locations = unique_keys
+    else:
+        locations = np.column_stack([np.bincount(index_map, weights=coords[:, dim]) / counts
+                                     for dim in range(coords.shape[1])]).astype(coords.dtype)
+
+    print(f"Collapsed {len(coords)} points onto {len(locations)} locations "
+          f"({len(coords) / max(len(locations), 1):.1f}x fewer)")
+    return locations, counts, index_map
@@ -2,6 +2,7 @@ import os
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
+from report import show_figure
 
 def explore_data(crash_data):
     # Overview of the dataset size
@@ -42,19 +43,20 @@ def visualize_data(crash_data):
         "C": "green",    # Possible injury
         "O": "blue"      # Property damage only
     }
-    crash_data["color"] = crash_data["Crash Severity"].map(severity_color_map)
+    # Kept out of crash_data so the caller's table isn't modified
+    colors = np.asarray(crash_data["Crash Severity"].map(severity_color_map), dtype=object)
 
     # Visualize the crashes to see dense areas - could compare to map for further analysis
     plt.figure(figsize=(10, 6))
     scatter = plt.scatter(
         crash_data["x"], crash_data["y"],
-        c=crash_data["color"],
+        c=colors,
         alpha=0.5,
     )
     plt.title("Traffic Crash Locations in Virginia")
     plt.xlabel("Longitude")
     plt.ylabel("Latitude")
-    plt.show()
+    show_figure()
 
 def correlation_features(crash_data):
     """Visualize the correlation between numeric features"""
@@ -65,4 +67,4 @@ def correlation_features(crash_data):
     plt.figure(figsize=(10, 8))
     sns.heatmap(corr_matrix, annot=True, cmap='coolwarm', fmt=".2f", linewidths=0.5)
     plt.title("Correlation Heatmap of Car Crash Features")
-    plt.show()
\ No newline at end of file
+    show_figure()
\ No newline at end of file
@@ -1,45 +1,233 @@
 from sklearn.cluster import DBSCAN
 import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, issparse
 import matplotlib.pyplot as plt
-from sklearn.neighbors import NearestNeighbors
+from sklearn.neighbors import BallTree, KDTree, NearestNeighbors
 from kneed import KneeLocator
-from sklearn.metrics import silhouette_score
+from cluster_metrics import cluster_quality, sampled_silhouette
+from grid_dbscan import GridDBSCAN
+from st_dbscan import STDBSCAN
+from report import show_figure
 
-def dbscan_clustering(spatial_data, eps=None, min_samples=5):
-    """Perform DBSCAN clustering on spatial data"""
+def dbscan_clustering(spatial_data, eps=None, min_samples=5, algorithm='sklearn',
+                      silhouette='sampled', sample_size=10000, sample_weight=None, eps_time=30.0):
+    """Perform DBSCAN clustering on spatial data
+
+    algorithm='grid' uses GridDBSCAN, the grid-hashed engine for 2-D
+    coordinates, instead of sklearn's general-purpose DBSCAN. silhouette is
+    passed to cluster_quality: 'sampled' (default) or 'exact'. eps is in the
+    units of spatial_data, i.e. meters for get_spatial_data(coords='projected').
+    sample_weight holds the crash counts of collapsed locations (see
+    collapse_locations); each location counts that many times towards
+    min_samples and in the reported counts and scores.
+
+    algorithm='st' runs STDBSCAN on (x, y, day) rows: crashes are neighbors
+    only within eps in space and eps_time days in time. eps is then searched
+    and the clusters scored on the spatial columns alone.
+    """
+    coords = spatial_data[:, :2] if algorithm == 'st' else spatial_data
     if eps is None:
-        eps = find_optimal_eps(spatial_data, min_samples)
+        eps = find_optimal_eps(coords, min_samples, sample_weight=sample_weight)
 
-    dbscan = DBSCAN(eps=eps, min_samples=min_samples)
-    cluster_labels = dbscan.fit_predict(spatial_data)
+    if algorithm == 'sklearn':
+        dbscan = DBSCAN(eps=eps, min_samples=min_samples)
+    elif algorithm == 'grid':
+        dbscan = GridDBSCAN(eps=eps, min_samples=min_samples)
+    elif algorithm == 'st':
+        dbscan = STDBSCAN(eps=eps, eps_time=eps_time, min_samples=min_samples)
+    else:
+        raise ValueError(f"Unknown DBSCAN algorithm: {algorithm}")
+    cluster_labels = dbscan.fit_predict(spatial_data, sample_weight=sample_weight)
 
+    weights = np.ones(len(cluster_labels)) if sample_weight is None else np.asarray(sample_weight)
     n_clusters = len(set(cluster_labels)) - (1 if -1 in cluster_labels else 0)
-    n_noise = list(cluster_labels).count(-1)
+    n_noise = int(weights[cluster_labels == -1].sum())
 
     print(f"DBSCAN clustering results:")
     print(f"- Number of clusters: {n_clusters}")
-    print(f"- Number of noise points: {n_noise} ({n_noise/len(spatial_data)*100:.2f}%)")
+    print(f"- Number of noise points: {n_noise} ({n_noise/weights.sum()*100:.2f}%)")
 
     if n_clusters > 1:
         mask = cluster_labels != -1
         if np.sum(mask) > n_clusters:  # Ensure we have enough points
-            silhouette_avg = silhouette_score(
-                spatial_data[mask],
-                cluster_labels[mask]
-            )
-            print(f"- Silhouette Score (excluding noise): {silhouette_avg:.4f}")
+            scores = cluster_quality(coords[mask], cluster_labels[mask],
+                                     silhouette=silhouette, sample_size=sample_size,
+                                     sample_weight=None if sample_weight is None else weights[mask])
+            print(f"- Silhouette Score (excluding noise): {scores['silhouette']:.4f} "
+                  f"(+/- {scores['silhouette_se']:.4f})")
 
     return dbscan, cluster_labels
 
-def find_optimal_eps(spatial_data, n_neighbors=10, visualize=False):
-    """Find optimal epsilon parameter for DBSCAN using k-distance graph"""
-    neigh = NearestNeighbors(n_neighbors=n_neighbors)
+def dbscan_sweep(spatial_data, eps_values, min_samples_values=(5,), sample_size=10000):
+    """Run DBSCAN over every (eps, min_samples) pair from one neighbor graph
+
+    The radius-neighbor graph is built once at the largest eps; each run
+    filters its edges down to its own eps and clusters on the precomputed
+    graph. Returns a DataFrame with the cluster count, noise fraction and a
+    sampled silhouette score (excluding noise) for each combination.
+    """
+    eps_values = sorted(eps_values)
+    graph = radius_neighbor_graph(spatial_data, max(eps_values))
+    n_points = graph.shape[0]
+
+    rows = []
+    for eps in eps_values:
+        eps_graph = _filter_graph(graph, eps)
+        for min_samples in min_samples_values:
+            cluster_labels = DBSCAN(eps=eps, min_samples=min_samples,
+                                    metric='precomputed').fit_predict(eps_graph)
+
+            n_clusters = len(set(cluster_labels)) - (1 if -1 in cluster_labels else 0)
+            mask = cluster_labels != -1
+            silhouette_avg = np.nan
+            if n_clusters > 1 and np.sum(mask) > n_clusters:
+                silhouette_avg, _ = sampled_silhouette(spatial_data[mask], cluster_labels[mask],
+                                                       sample_size=sample_size)
+
+            rows.append({
+                'eps': eps,
+                'min_samples': min_samples,
+                'n_clusters': n_clusters,
+                'noise_fraction': 1 - np.sum(mask) / n_points,
+                'silhouette': silhouette_avg,
+            })
+
+    return pd.DataFrame(rows)
+
+def radius_neighbor_graph(spatial_data, radius):
+    """Sparse CSR graph of the distances between all points within radius"""
+    neigh = NearestNeighbors(radius=radius)
     neigh.fit(spatial_data)
-    distances = neigh.kneighbors(spatial_data)
-    distances = np.sort(distances[:, n_neighbors-1])
+    return neigh.radius_neighbors_graph(spatial_data, mode='distance', sort_results=True)
+
+def _filter_graph(graph, eps):
+    """Keep only the graph's edges of length <= eps
+
+    Zero-distance edges (duplicate points) are kept explicitly, since DBSCAN
+    treats every stored entry of a precomputed graph as a neighbor.
+    """
+    keep = graph.data <= eps
+    rows = np.repeat(np.arange(graph.shape[0]), np.diff(graph.indptr))
+    row_counts = np.bincount(rows[keep], minlength=graph.shape[0])
+    indptr = np.concatenate([[0], np.cumsum(row_counts)])
+    return csr_matrix((graph.data[keep], graph.indices[keep], indptr), shape=graph.shape)
+
+def find_optimal_eps(spatial_data, n_neighbors=10, visualize=False, sample_size=20000,
+                     n_repeats=5, curve_points=1000, random_state=42, return_band=False,
+                     sample_weight=None):
+    """Find optimal epsilon parameter for DBSCAN using k-distance graph
 
-    diffs = np.diff(distances)
+    Instead of querying every point, stratified random samples are queried
+    against a KD-tree (BallTree in high dimensions) over the full data, and the
+    knee is found on a down-sampled k-distance curve. Repeating this over
+    n_repeats samples gives a 95% band for eps, returned with it if return_band.
+    Sparse input (the pipline output) is searched by brute force instead of
+    being densified for a tree. eps comes out in the units of spatial_data, so
+    in meters for projected coordinates. With sample_weight (crash counts of
+    collapsed locations), a location's k-distance is the distance at which its
+    neighbors add up to n_neighbors crashes, and it weighs its count in the curve.
+    """
+    if issparse(spatial_data):
+        spatial_data = csr_matrix(spatial_data)
+        neigh = NearestNeighbors(n_neighbors=n_neighbors, algorithm='brute').fit(spatial_data)
+        query = neigh.kneighbors
+    else:
+        spatial_data = np.asarray(spatial_data)
+        tree_cls = KDTree if spatial_data.shape[1] <= 15 else BallTree
+        query = tree_cls(spatial_data).query
+    n_points = spatial_data.shape[0]
+    if n_points <= sample_size:
+        n_repeats = 1
 
+    rng = np.random.default_rng(random_state)
+
+    estimates = []
+    curves = []
+    for _ in range(n_repeats):
+        sample = _stratified_sample(spatial_data, sample_size, rng)
+        # The query points are in the tree, so as before the point itself is the first neighbor
+        distances, neighbors = query(spatial_data[sample], n_neighbors)
+        if sample_weight is None:
+            curve = _downsample_curve(np.sort(distances[:, -1]), curve_points)
+        else:
+            weights = np.asarray(sample_weight, dtype=np.float64)
+            # Every location holds at least one crash, so n_neighbors locations always reach the count
+            reached = np.argmax(np.cumsum(weights[neighbors], axis=1) >= n_neighbors, axis=1)
+            k_distances = distances[np.arange(len(sample)), reached]
+            curve = _weighted_curve(k_distances, weights[sample], curve_points)
+        curves.append(curve)
+
+        eps = _knee_eps(curve)
+        if eps is not None:
+            estimates.append(eps)
+
+    if estimates:
+        optimal_eps = float(np.median(estimates))
+        eps_band = (float(np.percentile(estimates, 2.5)), float(np.percentile(estimates, 97.5)))
+        print(f"Optimal eps {optimal_eps:.4f} (95% band {eps_band[0]:.4f} - {eps_band[1]:.4f} "
+              f"over {len(estimates)} samples)")
+    else:
+        optimal_eps = None
+        eps_band = (None, None)
+
+    if visualize:
+        mean_curve = np.mean(curves, axis=0)
+        percentiles = np.linspace(0, 100, len(mean_curve))
+        plt.figure(figsize=(10, 6))
+        plt.plot(percentiles, mean_curve, 'b-')
+        if optimal_eps:
+            plt.axhline(y=optimal_eps, color='r', linestyle='-',
+                    label=f'Optimal eps = {optimal_eps:.4f}')
+            if eps_band[1] > eps_band[0]:
+                plt.axhspan(eps_band[0], eps_band[1], color='r', alpha=0.15, label='95% band')
+        plt.title('K-distance Graph for Optimal Epsilon Selection')
+        plt.xlabel('Points sorted by distance (percentile)')
+        plt.ylabel(f'Distance to {n_neighbors}th nearest neighbor')
+        plt.legend()
+        plt.grid(True)
+        show_figure()
+
+    if return_band:
+        return optimal_eps, eps_band
+    return optimal_eps
+
+def _stratified_sample(spatial_data, sample_size, rng, n_bins=10):
+    """Indices of a random sample spread proportionally over a grid of the first two dimensions"""
+    n_points = spatial_data.shape[0]
+    if n_points <= sample_size:
+        return np.arange(n_points)
+
+    strata = np.zeros(n_points, dtype=np.int64)
+    for dim in range(min(2, spatial_data.shape[1])):
+        values = spatial_data[:, dim]
+        if issparse(values):
+            values = values.toarray().ravel()
+        edges = np.linspace(values.min(), values.max(), n_bins + 1)[1:-1]
+        strata = strata * n_bins + np.searchsorted(edges, values)
+
+    # Shuffle within each stratum and keep each stratum's proportional quota
+    order = np.lexsort((rng.random(n_points), strata))
+    sorted_strata = strata[order]
+    _, starts, counts = np.unique(sorted_strata, return_index=True, return_counts=True)
+    quotas = np.maximum(np.round(counts * sample_size / n_points), 1).astype(np.int64)
+    rank = np.arange(n_points) - np.repeat(starts, counts)
+    return order[rank < np.repeat(quotas, counts)]
+
+def _downsample_curve(distances, curve_points):
+    if len(distances) <= curve_points:
+        return distances
+    return np.quantile(distances, np.linspace(0, 1, curve_points))
+
+def _weighted_curve(distances, weights, curve_points):
+    """The sorted curve of distances with each repeated weights times, at up to curve_points quantiles"""
+    order = np.argsort(distances, kind='stable')
+    distances, cum_weights = distances[order], np.cumsum(weights[order])
+    total = int(round(cum_weights[-1]))
+    ranks = np.round(np.linspace(0, total - 1, min(curve_points, total)))
+    return distances[np.searchsorted(cum_weights, ranks, side='right')]
+
+def _knee_eps(distances):
     try:
         kneedle = KneeLocator(
             range(len(distances)),
@@ -48,26 +236,10 @@ def find_optimal_eps(spatial_data, n_neighbors=10, visualize=False):
             curve='convex',
             direction='increasing'
         )
-        optimal_eps = distances[kneedle.elbow] if kneedle.elbow else None
+        return distances[kneedle.elbow] if kneedle.elbow else None
     except:
         # If KneeLocator fails, use a simple heuristic
         # Find where the distances start increasing rapidly
-        acceleration = np.diff(diffs)
+        acceleration = np.diff(np.diff(distances))
         elbow_idx = np.argmax(acceleration) + 1
-        optimal_eps = distances[elbow_idx]
-    
-    if visualize:
-        plt.figure(figsize=(10, 6))
-        plt.plot(range(len(distances)), distances, 'b-')
-        if optimal_eps:
-            plt.axhline(y=optimal_eps, color='r', linestyle='-',
-                    label=f'Optimal eps = {optimal_eps:.4f}')
-        plt.title('K-distance Graph for Optimal Epsilon Selection')
-        plt.xlabel('Points sorted by distance')
-        plt.ylabel(f'Distance to {n_neighbors}th nearest neighbor')
-        plt.legend()
-        plt.grid(True)
-        plt.show()
-
-    return optimal_eps
-    
+        return distances[elbow_idx]
@@ -0,0 +1,216 @@
+import numpy as np
+
+# 5x5 block of cells around a cell; with cells of side eps / sqrt(2) no point
+# farther out can be within eps
+_OFFSETS = [(dx, dy) for dx in range(-2, 3) for dy in range(-2, 3)]
+# One of each symmetric pair of distinct neighboring cells
+_HALF_OFFSETS = [(dx, dy) for dx, dy in _OFFSETS if dx > 0 or (dx == 0 and dy > 0)]
+
+class GridDBSCAN:
+    """DBSCAN for 2-D points (lon/lat, scaled or projected x/y) using an eps-sized grid
+
+    Points are hashed into square cells of side eps / sqrt(2), so every pair of
+    points in one cell is within eps and only the surrounding 5x5 cells need to
+    be searched. Any cell holding at least min_samples points (by weight) is all core
+    points; other points count their neighbors in those cells. Core cells are
+    merged with union-find and each border point joins the cluster of its
+    nearest core point. Distance work is done in blocks of at most max_pairs
+    point pairs, so memory stays bounded in dense cells.
+
+    Labels match sklearn's DBSCAN up to label permutation and the choice of
+    cluster for border points within eps of several clusters.
+    """
+
+    def __init__(self, eps=0.5, min_samples=5, max_pairs=2_000_000):
+        self.eps = eps
+        self.min_samples = min_samples
+        self.max_pairs = max_pairs
+
+    def fit(self, X, y=None, sample_weight=None):
+        """Cluster X; sample_weight counts each point that many times towards min_samples, as in sklearn"""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != 2:
+            raise ValueError(f"GridDBSCAN needs 2-D points, got shape {X.shape}")
+
+        n_points = len(X)
+        weights = np.ones(n_points) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        labels = np.full(n_points, -1, dtype=np.int64)
+        if n_points == 0:
+            self._set_result(X, labels, np.zeros(0, dtype=bool))
+            return self
+
+        self._eps2 = self.eps ** 2
+        self._hash_points(X)
+        self._weights = weights[self._order]
+        core = self._find_core_points()
+        self._sort_core_first(core)
+        core = self._core
+
+        cell_labels = self._merge_core_cells()
+        point_labels = np.full(n_points, -1, dtype=np.int64)
+        point_labels[core] = cell_labels[self._cell_of_point[core]]
+        self._assign_border_points(point_labels)
+
+        labels[self._order] = point_labels
+        core_mask = np.zeros(n_points, dtype=bool)
+        core_mask[self._order] = core
+        self._set_result(X, _relabel(labels), core_mask)
+        return self
+
+    def fit_predict(self, X, y=None, sample_weight=None):
+        return self.fit(X, sample_weight=sample_weight).labels_
+
+    def _set_result(self, X, labels, core_mask):
+        self.labels_ = labels
+        self.core_sample_indices_ = np.flatnonzero(core_mask)
+        self.components_ = X[self.core_sample_indices_].copy()
+
+    def _hash_points(self, X):
+        """Sort points by cell and build each cell's table of neighboring cells"""
+        side = self.eps / np.sqrt(2)
+        cell_xy = np.floor((X - X.min(axis=0)) / side).astype(np.int64)
+        # Pad the y range so that neighbor offsets never wrap into another column
+        self._stride = int(cell_xy[:, 1].max()) + 5
+        keys = cell_xy[:, 0] * self._stride + cell_xy[:, 1] + 2
+
+        self._order = np.argsort(keys, kind='stable')
+        self._points = X[self._order]
+        sorted_keys = keys[self._order]
+        self._cell_keys, self._cell_start, self._cell_count = np.unique(
+            sorted_keys, return_index=True, return_counts=True
+        )
+        self._cell_of_point = np.repeat(np.arange(len(self._cell_keys)), self._cell_count)
+
+        self._neighbors = np.stack([self._cells_at(dx, dy) for dx, dy in _OFFSETS], axis=1)
+
+    def _cells_at(self, dx, dy):
+        """Index of the cell at (dx, dy) from every cell, or -1 if it is empty"""
+        target = self._cell_keys + dx * self._stride + dy
+        idx = np.searchsorted(self._cell_keys, target)
+        idx[idx == len(self._cell_keys)] = 0
+        return np.where(self._cell_keys[idx] == target, idx, -1)
+
+    def _find_core_points(self):
+        cell_weight = np.bincount(self._cell_of_point, weights=self._weights, minlength=len(self._cell_keys))
+        core = cell_weight[self._cell_of_point] >= self.min_samples
+
+        # Only points of sparse cells need their neighbors counted
+        queries = np.flatnonzero(~core)
+        counts = np.zeros(len(self._points))
+        for query, candidate in self._candidate_pairs(queries):
+            within = self._within_eps(query, candidate)
+            counts += np.bincount(query[within], weights=self._weights[candidate[within]], minlength=len(counts))
+
+        core[queries] = counts[queries] >= self.min_samples
+        return core
+
+    def _sort_core_first(self, core):
+        """Reorder each cell so its core points come first"""
+        within_cell = np.lexsort((~core, self._cell_of_point))
+        self._order = self._order[within_cell]
+        self._points = self._points[within_cell]
+        self._weights = self._weights[within_cell]
+        self._core = core[within_cell]
+        self._core_count = np.bincount(self._cell_of_point[self._core],
+                                       minlength=len(self._cell_keys))
+
+    def _merge_core_cells(self):
+        """Union-find over cells with core points; returns each cell's root"""
+        n_cells = len(self._cell_keys)
+        parent = np.arange(n_cells)
+        core_cells = self._core_count > 0
+
+        for dx, dy in _HALF_OFFSETS:
+            other = self._neighbors[:, _OFFSETS.index((dx, dy))]
+            pairs = np.flatnonzero(core_cells & (other >= 0))
+            pairs = pairs[core_cells[other[pairs]]]
+
+            for a, b in zip(pairs, other[pairs]):
+                root_a, root_b = _find(parent, a), _find(parent, b)
+                if root_a != root_b and self._cores_touch(a, b):
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+
+        roots = np.array([_find(parent, c) for c in range(n_cells)], dtype=np.int64)
+        return np.where(core_cells, roots, -1)
+
+    def _cores_touch(self, a, b):
+        """Whether any core point of cell a is within eps of a core point of cell b"""
+        points_a = self._points[self._cell_start[a]:self._cell_start[a] + self._core_count[a]]
+        points_b = self._points[self._cell_start[b]:self._cell_start[b] + self._core_count[b]]
+        block = max(1, self.max_pairs // len(points_b))
+
+        for start in range(0, len(points_a), block):
+            diff = points_a[start:start + block, None, :] - points_b[None, :, :]
+            if np.any(np.einsum('ijk,ijk->ij', diff, diff) <= self._eps2):
+                return True
+        return False
+
+    def _assign_border_points(self, point_labels):
+        """Give each non-core point the label of its nearest core point within eps"""
+        queries = np.flatnonzero(~self._core)
+        best_dist = np.full(len(self._points), np.inf)
+
+        for query, candidate in self._candidate_pairs(queries, core_only=True):
+            diff = self._points[query] - self._points[candidate]
+            dist = np.einsum('ij,ij->i', diff, diff)
+            within = dist <= self._eps2
+            query, candidate, dist = query[within], candidate[within], dist[within]
+            if not len(query):
+                continue
+
+            # Nearest candidate per query in this block, then keep it if it beats earlier blocks
+            nearest = np.lexsort((dist, query))
+            first = np.r_[True, query[nearest][1:] != query[nearest][:-1]]
+            nearest = nearest[first]
+            better = dist[nearest] < best_dist[query[nearest]]
+            nearest = nearest[better]
+            best_dist[query[nearest]] = dist[nearest]
+            point_labels[query[nearest]] = point_labels[candidate[nearest]]
+
+    def _candidate_pairs(self, queries, core_only=False):
+        """Yield blocks of (query, candidate) sorted-point indices from neighboring cells"""
+        cells = self._neighbors[self._cell_of_point[queries]]
+        query_idx = np.repeat(queries, cells.shape[1])
+        cells = cells.ravel()
+        valid = cells >= 0
+        query_idx, cells = query_idx[valid], cells[valid]
+
+        lengths = self._core_count[cells] if core_only else self._cell_count[cells]
+        ends = np.cumsum(lengths)
+        start = 0
+        while start < len(cells):
+            # As many (query, cell) entries as fit in max_pairs, but at least one
+            offset = ends[start - 1] if start else 0
+            stop = max(start + 1, int(np.searchsorted(ends, offset + self.max_pairs, side='right')))
+            block_lengths = lengths[start:stop]
+            total = int(block_lengths.sum())
+
+            query = np.repeat(query_idx[start:stop], block_lengths)
+            local = np.arange(total) - np.repeat(np.cumsum(block_lengths) - block_lengths, block_lengths)
+            candidate = np.repeat(self._cell_start[cells[start:stop]], block_lengths) + local
+            yield query, candidate
+            start = stop
+
+    def _within_eps(self, query, candidate):
+        diff = self._points[query] - self._points[candidate]
+        return np.einsum('ij,ij->i', diff, diff) <= self._eps2
+
+def _find(parent, i):
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+def _relabel(labels):
+    """Renumber clusters 0..k-1 in order of each cluster's first point, keeping -1 as noise"""
+    clustered = labels >= 0
+    if not np.any(clustered):
+        return labels
+    roots, first = np.unique(labels[clustered], return_index=True)
+    ranks = np.empty(len(roots), dtype=np.int64)
+    ranks[np.argsort(first)] = np.arange(len(roots))
+    relabeled = labels.copy()
+    relabeled[clustered] = ranks[np.searchsorted(roots, labels[clustered])]
+    return relabeled
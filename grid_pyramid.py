@@ -0,0 +1,226 @@
+import argparse
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from load_data import load_data
+from data_cleaning import GEO_FEATURES, def_geo_features, compact_crash_table, table_categories
+from data_analysis import SUMMARY_COLUMNS, category_counts, grid_cluster_summary
+from hotspot_index import HOTSPOT_INDEX_PATH, load_hotspot_index
+from projection import VirginiaLambert
+
+GRID_PYRAMID_PATH = 'grid_pyramid.joblib'
+
+# Cell widths in meters, finest first; each level doubles the last
+CELL_SIZES = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# Web map meters per pixel at zoom 0 on the equator, and Virginia's central latitude
+_METERS_PER_PIXEL = 156543.03392
+_VA_LATITUDE = 37.5
+
+_SQRT3 = np.sqrt(3)
+_KEY_OFFSET = 2**31
+
+def build_grid_pyramid(crash_data_geo, cell_sizes=CELL_SIZES, shape='hex'):
+    """Aggregate crashes into hexagonal or square grids at several resolutions
+
+    Every level bins the crashes' Virginia Lambert coordinates into cells of
+    width cell_size meters (the distance between neighboring hex centers, or
+    the side of a square) and stores each cell's crash count with counts of
+    every category of Crash Severity and the condition columns, under the same
+    (column, category) columns as cluster_summary. Maps and analyses can then
+    read cell totals instead of the raw points; update_grid_pyramid adds new
+    crashes without a rebuild.
+    """
+    if shape not in ('hex', 'square'):
+        raise ValueError(f"Unknown grid shape: {shape}")
+
+    pyramid = {
+        'shape': shape,
+        'projection': VirginiaLambert(),
+        # Category lists of every crash added so far, so later batches are counted against the same ones
+        'categories': {},
+        'levels': [{'cell_size': float(cell_size), 'counts': None, 'lon': None, 'lat': None}
+                   for cell_size in sorted(cell_sizes)],
+    }
+    update_grid_pyramid(pyramid, crash_data_geo)
+    return pyramid
+
+def update_grid_pyramid(pyramid, crash_data_geo):
+    """Add crashes (with x/y lon/lat and category columns) to every level in place"""
+    crash_data_geo = compact_crash_table(crash_data_geo.dropna(subset=['x', 'y']),
+                                         categories=pyramid.setdefault('categories', {}))
+    pyramid['categories'] = table_categories(crash_data_geo)
+    xy = pyramid['projection'].transform(crash_data_geo[['x', 'y']].to_numpy(dtype=np.float64))
+
+    for level in pyramid['levels']:
+        keys = _cell_keys(xy, level['cell_size'], pyramid['shape'])
+        cells, codes = np.unique(keys, return_inverse=True)
+        parts = {('count', ''): np.bincount(codes, minlength=len(cells))}
+        parts.update(category_counts(crash_data_geo, codes, len(cells)))
+
+        counts = pd.DataFrame(parts, index=pd.Index(cells, name='cell'))
+        counts.columns = pd.MultiIndex.from_tuples(counts.columns)
+        if level['counts'] is not None:
+            # New cells and newly seen categories start from zero; known columns keep their order
+            columns = level['counts'].columns.append(counts.columns.difference(level['counts'].columns, sort=False))
+            cells = level['counts'].index.union(counts.index)
+            counts = (level['counts'].reindex(index=cells, columns=columns, fill_value=0)
+                      + counts.reindex(index=cells, columns=columns, fill_value=0)).astype(np.int64)
+        level['counts'] = counts
+
+        centers = _cell_centers(counts.index.to_numpy(), level['cell_size'], pyramid['shape'])
+        level['lon'], level['lat'] = pyramid['projection'].inverse_transform(centers).T
+    return pyramid
+
+def level_for_zoom(pyramid, zoom, cell_pixels=32):
+    """Index of the level whose cells are closest to cell_pixels wide at a web map zoom"""
+    meters_per_pixel = _METERS_PER_PIXEL * np.cos(np.radians(_VA_LATITUDE)) / 2**zoom
+    sizes = np.array([level['cell_size'] for level in pyramid['levels']])
+    return int(np.argmin(np.abs(np.log(sizes / (cell_pixels * meters_per_pixel)))))
+
+def level_with_at_most(pyramid, max_cells):
+    """Index of the finest level with at most max_cells cells (the coarsest if none is that small)"""
+    for i, level in enumerate(pyramid['levels']):
+        if len(level['counts']) <= max_cells:
+            return i
+    return len(pyramid['levels']) - 1
+
+def query_bbox(pyramid, bbox, level=0, zoom=None):
+    """Cells of one level whose centers fall in (lon_min, lat_min, lon_max, lat_max)
+
+    The level is picked with level_for_zoom when zoom is given. Returns the
+    cells' counts with their center lon/lat as the first two columns.
+    """
+    if zoom is not None:
+        level = level_for_zoom(pyramid, zoom)
+    level = pyramid['levels'][level]
+    lon_min, lat_min, lon_max, lat_max = bbox
+    inside = ((level['lon'] >= lon_min) & (level['lon'] <= lon_max)
+              & (level['lat'] >= lat_min) & (level['lat'] <= lat_max))
+
+    cells = level['counts'][inside]
+    centers = pd.DataFrame({('lon', ''): level['lon'][inside], ('lat', ''): level['lat'][inside]},
+                           index=cells.index)
+    return pd.concat([centers, cells], axis=1)
+
+def crashes_near(pyramid, lon, lat, radius_m, level=0):
+    """Summed counts of the cells whose centers are within radius_m meters of (lon, lat)
+
+    Exact up to the cell width of the level, so the finest level (0) is the
+    most precise; coarser levels answer the same question from fewer cells.
+    """
+    level = pyramid['levels'][level]
+    x, y = pyramid['projection'].transform([[lon, lat]])[0]
+    centers = _cell_centers(level['counts'].index.to_numpy(), level['cell_size'], pyramid['shape'])
+    near = np.hypot(centers[:, 0] - x, centers[:, 1] - y) <= radius_m
+    return level['counts'][near].sum()
+
+def cell_polygons(pyramid, level, cells):
+    """Closed GeoJSON [lon, lat] rings of the given cells of a level"""
+    level = pyramid['levels'][level]
+    centers = _cell_centers(np.asarray(cells), level['cell_size'], pyramid['shape'])
+    if pyramid['shape'] == 'hex':
+        angles = np.radians(30 + 60 * np.arange(6))
+        radius = level['cell_size'] / _SQRT3
+    else:
+        angles = np.radians(45 + 90 * np.arange(4))
+        radius = level['cell_size'] / np.sqrt(2)
+    corners = centers[:, None, :] + radius * np.stack([np.cos(angles), np.sin(angles)], axis=1)[None]
+
+    corners = np.concatenate([corners, corners[:, :1]], axis=1)
+
+    lon_lat = pyramid['projection'].inverse_transform(corners.reshape(-1, 2))
+    return np.round(lon_lat, 5).reshape(len(centers), -1, 2).tolist()
+
+def save_grid_pyramid(pyramid, path=GRID_PYRAMID_PATH):
+    joblib.dump(pyramid, path)
+
+def load_grid_pyramid(path=GRID_PYRAMID_PATH):
+    return joblib.load(path)
+
+def _cell_keys(xy, cell_size, shape):
+    """One int64 key per point for its cell's (column, row) or axial (q, r) coordinates"""
+    if shape == 'square':
+        i, j = np.floor(xy / cell_size).astype(np.int64).T
+    else:
+        i, j = _hex_round(xy, cell_size / _SQRT3)
+    return i * 2**32 + (j + _KEY_OFFSET)
+
+def _split_keys(keys):
+    return keys >> 32, (keys & 0xFFFFFFFF) - _KEY_OFFSET
+
+def _cell_centers(keys, cell_size, shape):
+    i, j = _split_keys(keys)
+    if shape == 'square':
+        return (np.column_stack([i, j]) + 0.5) * cell_size
+    # Pointy-top hexagons with circumradius cell_size / sqrt(3)
+    return np.column_stack([cell_size * (i + j / 2), cell_size * _SQRT3 / 2 * j])
+
+def _hex_round(xy, radius):
+    """Axial (q, r) of the pointy-top hexagon holding each point, by cube rounding"""
+    q = (_SQRT3 / 3 * xy[:, 0] - xy[:, 1] / 3) / radius
+    r = (2 / 3 * xy[:, 1]) / radius
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build, update and query the multi-resolution crash grid")
+    parser.add_argument('--pyramid', default=GRID_PYRAMID_PATH, help="Saved grid pyramid")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help="Aggregate the statewide extract")
+    build_parser.add_argument('--years', type=int, nargs='+', default=[2024, 2025])
+    build_parser.add_argument('--shape', choices=['hex', 'square'], default='hex')
+
+    update_parser = commands.add_parser('update', help="Add the crashes of a CSV extract")
+    update_parser.add_argument('csv')
+
+    bbox_parser = commands.add_parser('bbox', help="Cells of a bounding box at a zoom level")
+    bbox_parser.add_argument('bbox', type=float, nargs=4, metavar=('LON_MIN', 'LAT_MIN', 'LON_MAX', 'LAT_MAX'))
+    bbox_parser.add_argument('--zoom', type=float, default=12)
+
+    near_parser = commands.add_parser('near', help="Crash counts within a radius of a point")
+    near_parser.add_argument('lon', type=float)
+    near_parser.add_argument('lat', type=float)
+    near_parser.add_argument('--radius', type=float, default=500.0, help="Radius in meters")
+
+    summary_parser = commands.add_parser('summary', help="Per-hotspot counts read from the grid")
+    summary_parser.add_argument('--index', default=HOTSPOT_INDEX_PATH, help="Saved hotspot index")
+    summary_parser.add_argument('--method', choices=['dbscan', 'kmeans'], default='dbscan')
+    summary_parser.add_argument('--level', type=int, default=0)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        crash_data = load_data(columns=GEO_FEATURES, filters={'Crash Year': args.years})
+        pyramid = build_grid_pyramid(def_geo_features(crash_data), shape=args.shape)
+        save_grid_pyramid(pyramid, args.pyramid)
+        for level in pyramid['levels']:
+            print(f"{level['cell_size']:>8.0f} m: {len(level['counts'])} cells")
+        print(f"Grid pyramid written to {args.pyramid}")
+    else:
+        pyramid = load_grid_pyramid(args.pyramid)
+        if args.command == 'update':
+            update_grid_pyramid(pyramid, pd.read_csv(args.csv, usecols=GEO_FEATURES))
+            save_grid_pyramid(pyramid, args.pyramid)
+            print(f"{int(pyramid['levels'][0]['counts'][('count', '')].sum())} crashes in {args.pyramid}")
+        elif args.command == 'summary':
+            summary = grid_cluster_summary(pyramid, load_hotspot_index(args.index), method=args.method,
+                                           level=args.level)
+            print(summary[SUMMARY_COLUMNS + ['Crash Severity']].to_string(float_format='{:.4f}'.format))
+        elif args.command == 'bbox':
+            cells = query_bbox(pyramid, args.bbox, zoom=args.zoom)
+            print(cells[['lon', 'lat', 'count', 'Crash Severity']].to_string(float_format='{:.5f}'.format))
+        else:
+            counts = crashes_near(pyramid, args.lon, args.lat, args.radius)
+            print(f"{int(counts[('count', '')])} crashes within about {args.radius:.0f} m")
+            print(counts['Crash Severity'].to_string())
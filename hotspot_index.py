@@ -0,0 +1,134 @@
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+HOTSPOT_INDEX_PATH = 'hotspot_index.joblib'
+
+def build_hotspot_index(scaler, kmeans=None, dbscan=None):
+    """Index fitted hotspots so new crash locations can be assigned to them
+
+    Holds the fitted scaler from get_spatial_data, a KD-tree over the KMeans
+    centers and, for DBSCAN (sklearn or GridDBSCAN), a KD-tree over the core
+    samples with their labels and eps (no tree when the fit found no core
+    samples, so every lookup is noise). Both models must have been fitted on
+    the scaled coordinates.
+    """
+    index = {'scaler': scaler}
+
+    if kmeans is not None:
+        index['kmeans_tree'] = KDTree(kmeans.cluster_centers_)
+
+    if dbscan is not None:
+        index['dbscan_tree'] = KDTree(dbscan.components_) if len(dbscan.core_sample_indices_) else None
+        index['dbscan_core_labels'] = dbscan.labels_[dbscan.core_sample_indices_]
+        index['dbscan_eps'] = dbscan.eps
+
+    return index
+
+def query_hotspots(index, coords, method='dbscan'):
+    """Assign lon/lat points to their hotspot in one batch
+
+    Returns a DataFrame with the cluster id, the distance (in the clustering's
+    units: scaled, or meters for projected coordinates) to
+    the nearest KMeans center or DBSCAN core sample, and whether the point is
+    noise. Under DBSCAN a point is noise when no core sample is within eps, in
+    which case its cluster is -1; under KMeans only points without coordinates
+    are noise.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    coords = coords[:, :2] if coords.size else np.zeros((0, 2))
+    scaler = index['scaler']
+    if hasattr(scaler, 'feature_names_in_'):
+        coords = pd.DataFrame(coords, columns=scaler.feature_names_in_)
+    # sklearn rejects empty batches, which simply have nothing to assign
+    scaled_coords = scaler.transform(coords) if len(coords) else np.zeros((0, 2))
+    # Points without coordinates come back as noise with no distance
+    valid = np.isfinite(scaled_coords).all(axis=1)
+    clusters = np.full(len(scaled_coords), -1, dtype=np.int64)
+    distances = np.full(len(scaled_coords), np.nan)
+    is_noise = ~valid
+
+    if method not in ('kmeans', 'dbscan'):
+        raise ValueError(f"Unknown hotspot method: {method}")
+    tree = index[f'{method}_tree']
+    if tree is None:
+        # A DBSCAN fit without core samples has no hotspots to be near
+        is_noise[:] = True
+    elif valid.any():
+        dist, nearest = tree.query(scaled_coords[valid], k=1)
+        if method == 'kmeans':
+            clusters[valid] = nearest[:, 0]
+        else:
+            too_far = dist[:, 0] > index['dbscan_eps']
+            clusters[valid] = np.where(too_far, -1, index['dbscan_core_labels'][nearest[:, 0]])
+            is_noise[valid] = too_far
+        distances[valid] = dist[:, 0]
+
+    return pd.DataFrame({
+        'cluster': clusters,
+        'distance': distances,
+        'is_noise': is_noise,
+    })
+
+def save_hotspot_index(index, path=HOTSPOT_INDEX_PATH):
+    joblib.dump(index, path)
+
+def load_hotspot_index(path=HOTSPOT_INDEX_PATH):
+    return joblib.load(path)
+
+def serve_hotspots(index, host='127.0.0.1', port=8000):
+    """Serve POST /hotspots with a JSON body {"points": [[x, y], ...], "method": "dbscan"}"""
+
+    class HotspotHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/hotspots':
+                self.send_error(404)
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                result = query_hotspots(index, request['points'], method=request.get('method', 'dbscan'))
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                self.send_error(400, str(e))
+                return
+
+            body = json.dumps(result.to_dict(orient='list')).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    print(f"Serving hotspot lookups on http://{host}:{port}/hotspots")
+    HTTPServer((host, port), HotspotHandler).serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Look up the hotspot of new crash locations")
+    parser.add_argument('--index', default=HOTSPOT_INDEX_PATH, help="Saved hotspot index")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    query_parser = commands.add_parser('query', help="Assign the x/y rows of a CSV to hotspots")
+    query_parser.add_argument('csv', help="CSV with x (longitude) and y (latitude) columns")
+    query_parser.add_argument('--method', choices=['dbscan', 'kmeans'], default='dbscan')
+    query_parser.add_argument('--output', help="Write the results to this CSV instead of printing them")
+
+    serve_parser = commands.add_parser('serve', help="Serve lookups over local HTTP")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+
+    args = parser.parse_args()
+    index = load_hotspot_index(args.index)
+
+    if args.command == 'query':
+        coords = pd.read_csv(args.csv, usecols=['x', 'y'])[['x', 'y']]
+        result = query_hotspots(index, coords, method=args.method)
+        if args.output:
+            result.to_csv(args.output, index=False)
+        else:
+            print(result.to_string())
+    else:
+        serve_hotspots(index, host=args.host, port=args.port)
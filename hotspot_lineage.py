@@ -0,0 +1,266 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial.distance import cdist
+from threadpoolctl import threadpool_limits
+
+from load_data import load_data
+from data_cleaning import GEO_FEATURES, def_geo_features, get_spatial_data
+from db_scan import dbscan_clustering
+from k_means import find_optimal_k, kmeans_clustering
+from projection import VirginiaLambert
+from st_dbscan import DATE_COLUMN
+from instrumentation import stage, start_trace, stop_trace, tracing, add_records
+
+LINEAGE_YEARS = [2022, 2023, 2024, 2025]
+
+EVENT_COLUMNS = ['period_from', 'period_to', 'cluster_from', 'cluster_to', 'event', 'distance_m', 'overlap']
+
+# Cost of a pair the assignment must never pick
+_INFEASIBLE = 1e6
+
+def period_keys(crash_data, freq='year'):
+    """Period label of every crash: '2024' by Crash Year, or '2024Q1' by Crash Date"""
+    if freq == 'year':
+        return crash_data['Crash Year'].astype(str)
+    if freq == 'quarter':
+        return pd.to_datetime(crash_data[DATE_COLUMN]).dt.to_period('Q').astype(str)
+    raise ValueError(f"Unknown period frequency: {freq}")
+
+def run_period(crash_data, period, method='kmeans', eps=None, min_samples=10, n_clusters=None,
+               cell_size=250.0, n_jobs=-1):
+    """Cluster one period's crashes and summarize each cluster for matching
+
+    Coordinates are projected to Virginia Lambert meters, so centroids and
+    footprints of every period share one frame. A cluster's footprint is the
+    set of cell_size grid cells its crashes fall in.
+    """
+    with stage('def_geo_features', rows_in=len(crash_data)) as s:
+        crash_data_geo = def_geo_features(crash_data=crash_data)
+        s.rows_out = len(crash_data_geo)
+    with stage('get_spatial_data', rows_in=len(crash_data_geo)) as s:
+        _, projected_coords, _, _ = get_spatial_data(crash_data_geo=crash_data_geo, coords='projected')
+        s.rows_out = len(projected_coords)
+
+    with stage(f'{method}_clustering', rows_in=len(projected_coords)):
+        if method == 'kmeans':
+            if n_clusters is None:
+                n_clusters = find_optimal_k(spatial_data=projected_coords, n_jobs=n_jobs)
+            _, labels = kmeans_clustering(spatial_data=projected_coords, n_clusters=n_clusters)
+        elif method == 'dbscan':
+            _, labels = dbscan_clustering(spatial_data=projected_coords, eps=eps, min_samples=min_samples)
+        else:
+            raise ValueError(f"Unknown clustering method: {method}")
+
+    clustered = labels >= 0
+    clusters, sizes = np.unique(labels[clustered], return_counts=True)
+    centroids = np.column_stack([np.bincount(labels[clustered], weights=projected_coords[clustered, dim])[clusters]
+                                 for dim in range(2)]) / sizes[:, None]
+
+    # (cell, cluster) pairs, each cell listed once per cluster
+    cells = np.floor(projected_coords[clustered] / cell_size).astype(np.int64)
+    footprint = pd.DataFrame({'cell_x': cells[:, 0], 'cell_y': cells[:, 1],
+                              'cluster': labels[clustered]}).drop_duplicates(ignore_index=True)
+
+    return {
+        'period': period,
+        'n_crashes': len(crash_data_geo),
+        'clusters': clusters,
+        'sizes': sizes,
+        'centroids': centroids,
+        'footprint': footprint,
+        'labels': labels,
+        'index': crash_data_geo.index.to_numpy(),
+    }
+
+def _run_period_worker(crash_data, period, options, n_threads, trace=False):
+    # As in scenarios.py: cap each worker's BLAS threads and keep its k sweep in-process
+    if trace:
+        start_trace()
+    with threadpool_limits(limits=n_threads), stage(f"period {period}", rows_in=len(crash_data)):
+        result = run_period(crash_data, period, n_jobs=1, **options)
+    result['trace'] = stop_trace() if trace else []
+    return result
+
+def run_periods(crash_data=None, years=LINEAGE_YEARS, freq='year', max_workers=None, **options):
+    """Cluster every period in a process pool, loading the data only once
+
+    Returns a dict of period label to the result of run_period, in period
+    order. options (method, eps, min_samples, n_clusters, cell_size) are
+    passed to run_period.
+    """
+    if crash_data is None:
+        with stage('load_period_data') as s:
+            columns = GEO_FEATURES + ['Crash Year'] + ([DATE_COLUMN] if freq == 'quarter' else [])
+            crash_data = load_data(columns=columns, filters={'Crash Year': years})
+            s.rows_out = len(crash_data)
+
+    keys = period_keys(crash_data, freq)
+    periods = sorted(keys.unique())
+    if max_workers is None:
+        max_workers = min(len(periods), os.cpu_count() or 1)
+    n_threads = max(1, (os.cpu_count() or 1) // max_workers)
+
+    with stage('run_periods', rows_in=len(crash_data)), ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_run_period_worker, crash_data[(keys == period).to_numpy()], period, options,
+                            n_threads, tracing())
+            for period in periods
+        ]
+        results = [future.result() for future in futures]
+        for result in results:
+            add_records(result.pop('trace'))
+
+    return {result['period']: result for result in results}
+
+def match_periods(before, after, max_distance=2000.0, min_overlap=0.5):
+    """Events linking the clusters of two consecutive periods
+
+    Clusters are paired one to one by linear_sum_assignment on a cost of
+    centroid distance (as a fraction of max_distance) plus one minus the
+    Jaccard overlap of their footprints; pairs farther apart than max_distance
+    with no shared cell are never paired. Paired clusters persist. An unpaired
+    earlier cluster with at least min_overlap of its footprint inside a later
+    one merged into it, otherwise it vanished; an unpaired later cluster with
+    min_overlap of its footprint inside an earlier one split from it,
+    otherwise it appeared. Returns a DataFrame with one row per event.
+    """
+    n_before, n_after = len(before['clusters']), len(after['clusters'])
+    shared = _shared_cells(before, after)
+    cells_before = before['footprint']['cluster'].value_counts().reindex(before['clusters']).to_numpy()
+    cells_after = after['footprint']['cluster'].value_counts().reindex(after['clusters']).to_numpy()
+    jaccard = shared / (cells_before[:, None] + cells_after[None, :] - shared)
+    distance = cdist(before['centroids'], after['centroids']) if n_before and n_after else shared
+
+    feasible = (distance <= max_distance) | (shared > 0)
+    cost = np.where(feasible, distance / max_distance + 1 - jaccard, _INFEASIBLE)
+    rows, cols = linear_sum_assignment(cost)
+    keep = feasible[rows, cols]
+    rows, cols = rows[keep], cols[keep]
+
+    events = [(i, j, 'persist') for i, j in zip(rows, cols)]
+    for i in np.setdiff1d(np.arange(n_before), rows):
+        j = int(np.argmax(shared[i])) if n_after else 0
+        if n_after and shared[i, j] >= min_overlap * cells_before[i]:
+            events.append((i, j, 'merge'))
+        else:
+            events.append((i, None, 'vanish'))
+    for j in np.setdiff1d(np.arange(n_after), cols):
+        i = int(np.argmax(shared[:, j])) if n_before else 0
+        if n_before and shared[i, j] >= min_overlap * cells_after[j]:
+            events.append((i, j, 'split'))
+        else:
+            events.append((None, j, 'appear'))
+
+    return pd.DataFrame([{
+        'period_from': before['period'],
+        'period_to': after['period'],
+        'cluster_from': None if i is None else int(before['clusters'][i]),
+        'cluster_to': None if j is None else int(after['clusters'][j]),
+        'event': event,
+        'distance_m': np.nan if i is None or j is None else distance[i, j],
+        'overlap': np.nan if i is None or j is None else jaccard[i, j],
+    } for i, j, event in events], columns=EVENT_COLUMNS).astype({'cluster_from': 'Int64', 'cluster_to': 'Int64'})
+
+def hotspot_lineage(period_results, max_distance=2000.0, min_overlap=0.5):
+    """Lineage tables over consecutive periods
+
+    Returns (clusters, events). clusters has one row per period and cluster
+    with its size, lon/lat centroid and hotspot_id, which a cluster inherits
+    from the one it persists from; appearing and split-off clusters start a
+    new id. events is match_periods over each pair of consecutive periods,
+    with the hotspot ids on both ends.
+    """
+    results = list(period_results.values())
+    projection = VirginiaLambert()
+
+    hotspot_ids = {}
+    next_id = 0
+    all_events = []
+    for position, result in enumerate(results):
+        inherited = {}
+        if position > 0:
+            events = match_periods(results[position - 1], result, max_distance, min_overlap)
+            for event in events.itertuples():
+                if event.event == 'persist':
+                    inherited[event.cluster_to] = hotspot_ids[(event.period_from, event.cluster_from)]
+            all_events.append(events)
+
+        for cluster in result['clusters']:
+            if cluster not in inherited:
+                inherited[cluster] = next_id
+                next_id += 1
+            hotspot_ids[(result['period'], cluster)] = inherited[cluster]
+
+    tables = []
+    for result in results:
+        lon_lat = projection.inverse_transform(result['centroids'].reshape(-1, 2))
+        tables.append(pd.DataFrame({
+            'period': result['period'],
+            'cluster': result['clusters'],
+            # An empty list would make the column float once concatenated with the other periods
+            'hotspot_id': np.array([hotspot_ids[(result['period'], c)] for c in result['clusters']],
+                                   dtype=np.int64),
+            'n_crashes': result['sizes'],
+            'lon': lon_lat[:, 0],
+            'lat': lon_lat[:, 1],
+        }))
+    clusters = pd.concat(tables, ignore_index=True)
+
+    events = pd.concat(all_events, ignore_index=True) if all_events else pd.DataFrame(columns=EVENT_COLUMNS)
+    for end in ('from', 'to'):
+        keys = zip(events[f'period_{end}'], events[f'cluster_{end}'])
+        events[f'hotspot_{end}'] = pd.array([hotspot_ids.get(key) for key in keys], dtype='Int64')
+    return clusters, events
+
+def _shared_cells(before, after):
+    """Number of footprint cells each earlier cluster shares with each later one"""
+    pairs = before['footprint'].merge(after['footprint'], on=['cell_x', 'cell_y'], suffixes=('_from', '_to'))
+    shared = np.zeros((len(before['clusters']), len(after['clusters'])))
+    if len(pairs):
+        counts = pairs.groupby(['cluster_from', 'cluster_to']).size()
+        rows = np.searchsorted(before['clusters'], counts.index.get_level_values(0))
+        cols = np.searchsorted(after['clusters'], counts.index.get_level_values(1))
+        shared[rows, cols] = counts.to_numpy()
+    return shared
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cluster each period in parallel and trace hotspots across periods")
+    parser.add_argument('--years', type=int, nargs='+', default=LINEAGE_YEARS)
+    parser.add_argument('--freq', choices=['year', 'quarter'], default='year')
+    parser.add_argument('--method', choices=['kmeans', 'dbscan'], default='kmeans')
+    parser.add_argument('--n-clusters', type=int, help="KMeans clusters per period (default: elbow search per period)")
+    parser.add_argument('--eps', type=float, help="DBSCAN eps in meters (default: searched per period)")
+    parser.add_argument('--min-samples', type=int, default=10)
+    parser.add_argument('--cell-size', type=float, default=250.0, help="Footprint cell side in meters")
+    parser.add_argument('--max-distance', type=float, default=2000.0,
+                        help="Farthest apart (in meters) two non-overlapping clusters can be matched")
+    parser.add_argument('--min-overlap', type=float, default=0.5)
+    parser.add_argument('--max-workers', type=int)
+    parser.add_argument('--output', metavar='PREFIX',
+                        help="Write PREFIX_clusters.csv and PREFIX_events.csv")
+    args = parser.parse_args()
+
+    options = {'method': args.method, 'cell_size': args.cell_size}
+    if args.method == 'kmeans':
+        options['n_clusters'] = args.n_clusters
+    else:
+        options.update(eps=args.eps, min_samples=args.min_samples)
+
+    results = run_periods(years=args.years, freq=args.freq, max_workers=args.max_workers, **options)
+    with stage('hotspot_lineage'):
+        clusters, events = hotspot_lineage(results, max_distance=args.max_distance, min_overlap=args.min_overlap)
+
+    print("\nClusters per period:")
+    print(clusters.groupby('period').agg(clusters=('cluster', 'size'), crashes=('n_crashes', 'sum')).to_string())
+    print("\nHotspot events:")
+    print(pd.crosstab([events['period_from'], events['period_to']], events['event']).to_string())
+
+    if args.output:
+        clusters.to_csv(f'{args.output}_clusters.csv', index=False)
+        events.to_csv(f'{args.output}_events.csv', index=False)
+        print(f"\nLineage written to {args.output}_clusters.csv and {args.output}_events.csv")
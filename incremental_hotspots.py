@@ -0,0 +1,156 @@
+import argparse
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+
+from load_data import load_data
+from data_cleaning import GEO_FEATURES, SEVERITY_LEVELS, def_geo_features, get_spatial_data
+from k_means import find_optimal_k
+
+HOTSPOT_STATE_PATH = 'hotspot_state.joblib'
+
+def fit_hotspots(crash_data_geo, n_clusters=None, batch_size=4096):
+    """Fit MiniBatchKMeans hotspots from scratch and return the state to persist
+
+    The state holds the fitted scaler from get_spatial_data, the model, and
+    per-cluster sufficient statistics (counts, lon/lat sums, severity counts),
+    so later batches can be folded in without revisiting old crashes.
+    """
+    spatial_data, scaled_coords, original_coords, scaler = get_spatial_data(crash_data_geo=crash_data_geo)
+    if n_clusters is None:
+        n_clusters = find_optimal_k(spatial_data=scaled_coords, mode='minibatch')
+
+    model = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3, batch_size=batch_size)
+    model.fit(scaled_coords)
+
+    state = {
+        'scaler': scaler,
+        'model': model,
+        'counts': np.zeros(n_clusters, dtype=np.int64),
+        'sums': np.zeros((n_clusters, 2)),
+        'severity_counts': np.zeros((n_clusters, len(SEVERITY_LEVELS)), dtype=np.int64),
+        'n_seen': 0,
+        # Mean squared distance to the nearest center at fit time, the drift baseline
+        'baseline_sq_dist': -model.score(scaled_coords) / len(scaled_coords),
+        'fitted_at': datetime.now().isoformat(timespec='seconds'),
+        'updates': [],
+        'needs_refit': False,
+    }
+    _add_to_stats(state, crash_data_geo, original_coords, model.predict(scaled_coords))
+    return state
+
+def update_hotspots(state, new_crash_data_geo, drift_threshold=0.25):
+    """Fold a batch of new crashes into the hotspot state in place
+
+    The persisted scaler is reused as is, the centers take one partial_fit step
+    on the new rows and only the new rows are added to the cluster statistics,
+    so the cost is proportional to the batch. Returns the batch's drift: the
+    relative increase of its mean squared distance to the nearest center over
+    the fit-time baseline. Above drift_threshold, state['needs_refit'] is set.
+    """
+    coords = new_crash_data_geo[['x', 'y']].dropna()
+    if len(coords) == 0:
+        return 0.0
+
+    scaled_coords = state['scaler'].transform(coords)
+    model = state['model']
+
+    # Drift is measured against the centers before they adapt to the batch
+    sq_dist = -model.score(scaled_coords) / len(scaled_coords)
+    drift = sq_dist / state['baseline_sq_dist'] - 1
+
+    model.partial_fit(scaled_coords)
+    _add_to_stats(state, new_crash_data_geo.loc[coords.index], coords, model.predict(scaled_coords))
+
+    state['updates'].append({
+        'at': datetime.now().isoformat(timespec='seconds'),
+        'rows': len(coords),
+        'drift': float(drift),
+    })
+    state['needs_refit'] = bool(drift > drift_threshold)
+    print(f"Folded {len(coords)} crashes into {model.n_clusters} hotspots (drift {drift:+.2%})")
+    if state['needs_refit']:
+        print(f"Drift exceeds {drift_threshold:.0%}, a full refit is recommended")
+
+    return drift
+
+def hotspot_table(state):
+    """Per-hotspot counts, lon/lat centers and severity counts from the sufficient statistics"""
+    counts = state['counts']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centers = state['sums'] / counts[:, None]
+
+    table = pd.DataFrame({
+        'size': counts,
+        'center_x': centers[:, 0],
+        'center_y': centers[:, 1],
+    })
+    for j, level in enumerate(SEVERITY_LEVELS):
+        table[level] = state['severity_counts'][:, j]
+    table.index.name = 'cluster'
+    return table
+
+def save_state(state, path=HOTSPOT_STATE_PATH):
+    joblib.dump(state, path)
+
+def load_state(path=HOTSPOT_STATE_PATH):
+    return joblib.load(path)
+
+def _add_to_stats(state, crash_data_geo, original_coords, labels):
+    n_clusters = len(state['counts'])
+    coords = np.asarray(original_coords, dtype=np.float64)[:, :2]
+
+    state['counts'] += np.bincount(labels, minlength=n_clusters)
+    for dim in range(2):
+        state['sums'][:, dim] += np.bincount(labels, weights=coords[:, dim], minlength=n_clusters)
+
+    if 'Crash Severity' in crash_data_geo.columns:
+        severity = pd.Categorical(crash_data_geo['Crash Severity'], categories=SEVERITY_LEVELS).codes
+        known = severity >= 0
+        state['severity_counts'] += np.bincount(
+            labels[known] * len(SEVERITY_LEVELS) + severity[known],
+            minlength=n_clusters * len(SEVERITY_LEVELS)
+        ).reshape(n_clusters, len(SEVERITY_LEVELS))
+    state['n_seen'] += len(labels)
+
+def _load_geo(path=None, years=None):
+    if path is None:
+        crash_data = load_data(columns=GEO_FEATURES, filters={'Crash Year': years})
+    else:
+        crash_data = load_data(columns=GEO_FEATURES, path=path, use_cache=False)
+    return def_geo_features(crash_data=crash_data)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Incrementally maintained KMeans crash hotspots")
+    parser.add_argument('--state', default=HOTSPOT_STATE_PATH, help="Hotspot state file")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fit_parser = commands.add_parser('fit', help="Fit the hotspots from scratch on the statewide extract")
+    fit_parser.add_argument('--years', type=int, nargs='+', default=[2024, 2025])
+    fit_parser.add_argument('--k', type=int, default=None, help="Number of hotspots (default: elbow method)")
+
+    update_parser = commands.add_parser('update', help="Fold a CSV of new crashes into the hotspots")
+    update_parser.add_argument('csv', help="New crash records, same columns as crash_data.csv")
+    update_parser.add_argument('--drift-threshold', type=float, default=0.25)
+    update_parser.add_argument('--refit', action='store_true',
+                               help="Refit from the statewide extract afterwards, even without drift")
+    update_parser.add_argument('--years', type=int, nargs='+', default=[2024, 2025],
+                               help="Years of the statewide extract used for a refit")
+
+    args = parser.parse_args()
+
+    if args.command == 'fit':
+        state = fit_hotspots(_load_geo(years=args.years), n_clusters=args.k)
+    else:
+        state = load_state(args.state)
+        update_hotspots(state, _load_geo(path=args.csv), drift_threshold=args.drift_threshold)
+        if args.refit or state['needs_refit']:
+            # The monthly records are expected to have been appended to the statewide extract
+            print("Refitting hotspots from the statewide extract")
+            state = fit_hotspots(_load_geo(years=args.years), n_clusters=state['model'].n_clusters)
+
+    save_state(state, args.state)
+    print(hotspot_table(state).to_string(float_format='{:.4f}'.format))
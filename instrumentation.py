@@ -0,0 +1,259 @@
+import cProfile
+import functools
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Set while a trace is being recorded; None keeps every stage a no-op
+_trace = None
+
+def start_trace(path=None, profile=()):
+    """Start recording pipeline stages
+
+    Every stage entered from now on records its wall time, CPU time, peak RSS
+    and row counts. stop_trace() writes them to path as JSON (when given).
+    Stages named in profile additionally run under cProfile, with the stats
+    dumped next to the trace as <stage>.prof.
+    """
+    global _trace
+    _trace = {
+        'path': path,
+        'profile': set(profile),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'start': time.perf_counter(),
+        'records': [],
+        'stack': [],
+        'profiler_active': False,
+    }
+
+def stop_trace():
+    """Stop recording, write the JSON trace and return the stage records"""
+    global _trace
+    if _trace is None:
+        return []
+    trace, _trace = _trace, None
+
+    if trace['path']:
+        with open(trace['path'], 'w') as f:
+            json.dump({
+                'started_at': trace['started_at'],
+                'argv': sys.argv,
+                'stages': trace['records'],
+            }, f, indent=2)
+    return trace['records']
+
+def tracing():
+    return _trace is not None
+
+def add_records(records):
+    """Fold stage records from a worker process into the running trace, under the current stage"""
+    if _trace is None:
+        return
+    stack = _trace['stack']
+    # Worker times are relative to the worker's own trace, which started inside the current stage
+    offset = stack[-1].wall_start - _trace['start'] if stack else 0.0
+    for record in records:
+        record = dict(record)
+        record['parent'] = record['parent'] or (stack[-1].name if stack else None)
+        record['depth'] += len(stack)
+        record['start_s'] = round(record['start_s'] + offset, 4)
+        _trace['records'].append(record)
+
+def print_trace(records):
+    """One line per stage, each stage followed by its nested stages"""
+    print(f"\n{'Stage':<44}{'wall s':>9}{'cpu s':>9}{'peak MB':>10}{'rows in':>10}{'rows out':>10}")
+    for record in _tree_order(records):
+        name = '  ' * record['depth'] + record['name']
+        rows_in = '' if record['rows_in'] is None else record['rows_in']
+        rows_out = '' if record['rows_out'] is None else record['rows_out']
+        peak = '' if record['peak_rss_mb'] is None else f"{record['peak_rss_mb']:.1f}"
+        print(f"{name[:43]:<44}{record['wall_s']:>9.3f}{record['cpu_s']:>9.3f}{peak:>10}{rows_in:>10}{rows_out:>10}")
+
+class stage:
+    """Context manager recording one pipeline stage while a trace is running
+
+        with stage('pipline', rows_in=len(crash_data_geo)) as s:
+            processed = pipline(crash_data_geo=crash_data_geo)
+            s.rows_out = len(processed)
+
+    Without a trace, entering and leaving a stage does nothing else. CPU time
+    covers this process plus any child processes that exited during the stage;
+    long-lived pool workers (joblib's) are not included.
+    """
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.active = False
+
+    def __enter__(self):
+        if _trace is None:
+            return self
+        self.active = True
+
+        # A stage resets the process's peak RSS, so hand the peak so far to the enclosing stage first
+        if _trace['stack']:
+            parent = _trace['stack'][-1]
+            parent.peak_seen = _max_or_none(parent.peak_seen, _peak_rss_mb())
+        self.peak_seen = None
+        self.reset_peak = _reset_peak_rss()
+        self.rss_start = _rss_mb()
+        self.children_cpu_start = _children_cpu()
+        self.profiler = None
+        if self.name in _trace['profile'] and not _trace['profiler_active']:
+            self.profiler = cProfile.Profile()
+            _trace['profiler_active'] = True
+        _trace['stack'].append(self)
+
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.active or _trace is None:
+            return False
+
+        if self.profiler is not None:
+            self.profiler.disable()
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        children_cpu = _children_cpu() - self.children_cpu_start
+        _trace['stack'].pop()
+
+        peak = _max_or_none(self.peak_seen, _peak_rss_mb())
+        if _trace['stack']:
+            parent = _trace['stack'][-1]
+            parent.peak_seen = _max_or_none(parent.peak_seen, peak)
+
+        profile_path = None
+        if self.profiler is not None:
+            _trace['profiler_active'] = False
+            profile_path = os.path.join(os.path.dirname(_trace['path'] or '') or '.', f"{_slug(self.name)}.prof")
+            self.profiler.dump_stats(profile_path)
+
+        _trace['records'].append({
+            'name': self.name,
+            'parent': _trace['stack'][-1].name if _trace['stack'] else None,
+            'depth': len(_trace['stack']),
+            'start_s': round(self.wall_start - _trace['start'], 4),
+            'wall_s': round(wall, 4),
+            'cpu_s': round(cpu + children_cpu, 4),
+            'rss_start_mb': self.rss_start,
+            # Without a resettable peak (non-Linux) this is the process's lifetime peak
+            'peak_rss_mb': peak,
+            'peak_is_lifetime': not self.reset_peak,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'failed': exc_type is not None,
+            'profile': profile_path,
+        })
+        return False
+
+def traced(name=None):
+    """Decorator recording every call of a function as a stage while a trace is running
+
+    Row counts are taken from the first argument and from the result (the last
+    array-like item when the result is a tuple).
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _trace is None:
+                return func(*args, **kwargs)
+            first = args[0] if args else next(iter(kwargs.values()), None)
+            with stage(stage_name, rows_in=_count_rows(first)) as s:
+                result = func(*args, **kwargs)
+                s.rows_out = _count_rows(result)
+            return result
+
+        return wrapper
+    return decorator
+
+def _tree_order(records):
+    # Records are appended as stages end, so every stage follows its nested stages
+    roots = []
+    for record in records:
+        children = []
+        while roots and roots[-1][0]['depth'] > record['depth']:
+            children.insert(0, roots.pop())
+        roots.append((record, children))
+
+    ordered = []
+    def visit(node):
+        ordered.append(node[0])
+        for child in node[1]:
+            visit(child)
+    for node in roots:
+        visit(node)
+    return ordered
+
+def _count_rows(obj):
+    if isinstance(obj, tuple):
+        for item in reversed(obj):
+            rows = _count_rows(item)
+            if rows is not None:
+                return rows
+        return None
+    shape = getattr(obj, 'shape', None)
+    if shape:
+        return int(shape[0])
+    return None
+
+def _reset_peak_rss():
+    # Linux resets the VmHWM high-water mark when 5 is written to clear_refs
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _proc_status_mb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def _rss_mb():
+    return _proc_status_mb('VmRSS:')
+
+def _peak_rss_mb():
+    peak = _proc_status_mb('VmHWM:')
+    if peak is None and resource is not None:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 2**20 if sys.platform == 'darwin' else 2**10
+        peak = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+    return peak
+
+def _children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def _max_or_none(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+def _slug(text):
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')[:60] or 'stage'
@@ -1,38 +1,46 @@
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score, calinski_harabasz_score, davies_bouldin_score
+import hashlib
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+from joblib import Parallel, delayed
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from kneed import KneeLocator
 import matplotlib.pyplot as plt
+from cluster_metrics import cluster_quality
+from report import show_figure
+
+# Elbow curves keyed by (input fingerprint, max_k, mode), shared by every caller in the process
+_SWEEP_CACHE = {}
+
+def kmeans_clustering(spatial_data, n_clusters=None, silhouette='sampled', sample_size=10000,
+                      sample_weight=None):
+    """Perform KMeans clustering on spatial data
 
-def kmeans_clustering(spatial_data, n_clusters=None):
-    """Perform KMeans clustering on spatial data"""
+    silhouette is passed to cluster_quality: 'sampled' (default) or 'exact'.
+    sample_weight holds the crash counts of collapsed locations, which then
+    pull on the centers and count in the scores as that many crashes.
+    """
     if n_clusters is None:
-        n_clusters = find_optimal_k(spatial_data)
+        n_clusters = find_optimal_k(spatial_data, sample_weight=sample_weight)
 
     kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    cluster_labels = kmeans.fit_predict(spatial_data)
+    cluster_labels = kmeans.fit_predict(spatial_data, sample_weight=sample_weight)
 
-    silhouette_avg = silhouette_score(spatial_data, cluster_labels)
-    calinski_score = calinski_harabasz_score(spatial_data, cluster_labels)
-    davies_score = davies_bouldin_score(spatial_data, cluster_labels)
+    scores = cluster_quality(spatial_data, cluster_labels, silhouette=silhouette, sample_size=sample_size,
+                             sample_weight=sample_weight)
 
     print(f"KMeans clustering results:")
     print(f"- Number of clusters: {n_clusters}")
-    print(f"- Silhouette Score: {silhouette_avg:.4f}")
-    print(f"- Calinski-Harabasz Index: {calinski_score:.4f}")
-    print(f"- Davies-Bouldin Index: {davies_score:.4f}")
+    print(f"- Silhouette Score: {scores['silhouette']:.4f} (+/- {scores['silhouette_se']:.4f})")
+    print(f"- Calinski-Harabasz Index: {scores['calinski_harabasz']:.4f}")
+    print(f"- Davies-Bouldin Index: {scores['davies_bouldin']:.4f}")
 
     return kmeans, cluster_labels
 
-def find_optimal_k(spatial_data, max_k=20, visualize=False):
+def find_optimal_k(spatial_data, max_k=20, visualize=False, mode='full', n_jobs=-1, sample_weight=None):
     """Find optimal number of clusters for KMeans using Elbow method"""
-    inertia = []
-    silhouette_scores = []
-
-    K_range = range(2, max_k + 1)
-    for k in K_range:
-        kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-        kmeans.fit(spatial_data)
-        inertia.append(kmeans.inertia_)
+    K_range, inertia = k_sweep(spatial_data, max_k=max_k, mode=mode, n_jobs=n_jobs,
+                               sample_weight=sample_weight)
 
     try:
         kneedle_inertia = KneeLocator(
@@ -58,8 +66,83 @@ def find_optimal_k(spatial_data, max_k=20, visualize=False):
         plt.legend()
         plt.grid(True)
         plt.tight_layout()
-        plt.show()
+        show_figure()
 
         print(f"Optimal k by Elbow Method: {optimal_k_inertia}")
 
-    return optimal_k_inertia
\ No newline at end of file
+    return optimal_k_inertia
+
+def k_sweep(spatial_data, max_k=20, mode='full', n_jobs=-1, batch_size=4096, sample_weight=None):
+    """Compute the inertia of k = 2..max_k, reusing a cached curve for the same input
+
+    mode='full' fits KMeans(n_init=10) for every k, spread over n_jobs worker
+    processes. mode='warm' fits k = 2 fully and seeds each k + 1 from the k
+    solution, splitting off the point farthest from its center. mode='minibatch'
+    uses MiniBatchKMeans for large inputs. With sample_weight every fit is
+    weighted, so the inertia is that of the crashes behind collapsed locations.
+    """
+    weight_key = None if sample_weight is None else _fingerprint(np.asarray(sample_weight, dtype=np.float64))
+    key = (_fingerprint(spatial_data), weight_key, max_k, mode)
+    if key in _SWEEP_CACHE:
+        return _SWEEP_CACHE[key]
+
+    K_range = range(2, max_k + 1)
+    if mode == 'full':
+        inertia = Parallel(n_jobs=n_jobs)(
+            delayed(_fit_inertia)(spatial_data, k, sample_weight) for k in K_range
+        )
+    elif mode == 'minibatch':
+        inertia = Parallel(n_jobs=n_jobs)(
+            delayed(_fit_minibatch_inertia)(spatial_data, k, batch_size, sample_weight) for k in K_range
+        )
+    elif mode == 'warm':
+        inertia = _warm_sweep(spatial_data, K_range, sample_weight)
+    else:
+        raise ValueError(f"Unknown k sweep mode: {mode}")
+
+    _SWEEP_CACHE[key] = (K_range, list(inertia))
+    return _SWEEP_CACHE[key]
+
+def _fingerprint(spatial_data):
+    if issparse(spatial_data):
+        spatial_data = csr_matrix(spatial_data)
+        digest = hashlib.sha1(b'csr')
+        for part in (spatial_data.data, spatial_data.indices, spatial_data.indptr):
+            digest.update(np.ascontiguousarray(part).view(np.uint8))
+        digest.update(str((spatial_data.shape, spatial_data.dtype.str)).encode())
+        return digest.hexdigest()
+
+    data = np.ascontiguousarray(spatial_data)
+    digest = hashlib.sha1(data.view(np.uint8))
+    digest.update(str((data.shape, data.dtype.str)).encode())
+    return digest.hexdigest()
+
+def _fit_inertia(spatial_data, k, sample_weight=None):
+    kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
+    kmeans.fit(spatial_data, sample_weight=sample_weight)
+    return kmeans.inertia_
+
+def _fit_minibatch_inertia(spatial_data, k, batch_size, sample_weight=None):
+    kmeans = MiniBatchKMeans(n_clusters=k, random_state=42, n_init=3, batch_size=batch_size)
+    kmeans.fit(spatial_data, sample_weight=sample_weight)
+    # MiniBatchKMeans.inertia_ is only an estimate, so score the final centers exactly
+    return -kmeans.score(spatial_data, sample_weight=sample_weight)
+
+def _warm_sweep(spatial_data, K_range, sample_weight=None):
+    spatial_data = csr_matrix(spatial_data) if issparse(spatial_data) else np.asarray(spatial_data)
+    inertia = []
+    kmeans = None
+    for k in K_range:
+        if kmeans is None:
+            kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
+        else:
+            # Seed k from the previous solution plus the worst-served point
+            distances = kmeans.transform(spatial_data).min(axis=1)
+            new_center = spatial_data[[np.argmax(distances)]]
+            if issparse(new_center):
+                new_center = new_center.toarray()
+            init = np.vstack([kmeans.cluster_centers_, new_center])
+            kmeans = KMeans(n_clusters=k, init=init, n_init=1)
+        kmeans.fit(spatial_data, sample_weight=sample_weight)
+        inertia.append(kmeans.inertia_)
+    return inertia
@@ -1,5 +1,182 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
 import pandas as pd
 
-def load_data():
-  crash_data = pd.read_csv('crash_data.csv')
-  return crash_data
\ No newline at end of file
+CRASH_DATA_PATH = 'crash_data.csv'
+CACHE_DIR = '.crash_cache'
+MANIFEST_NAME = 'manifest.json'
+
+def load_data(columns=None, filters=None, path=CRASH_DATA_PATH, cache_dir=CACHE_DIR,
+              use_cache=True, chunksize=100_000):
+  """Load crash data, reading columns from a columnar cache of the CSV
+
+  filters maps a column name to the values it may take, e.g.
+  {'Crash Year': [2024, 2025], 'Alcohol?': ['Yes']}. Rows must match every
+  filter, and only matching rows are ever materialized.
+  """
+  if not use_cache:
+    return _stream_csv(path, columns, filters, chunksize)
+
+  column_dir = _cache_path(path, cache_dir)
+  manifest = _ensure_cache(path, column_dir)
+
+  if columns is None:
+    columns = [entry['name'] for entry in manifest['columns']]
+  entries = _lookup_columns(manifest, columns, path)
+
+  rows = None
+  if filters:
+    filter_entries = _lookup_columns(manifest, list(filters), path)
+    mask = np.ones(manifest['n_rows'], dtype=bool)
+    for entry in filter_entries:
+      _apply_filter(column_dir, entry, filters[entry['name']], mask, chunksize)
+    rows = np.flatnonzero(mask)
+
+  crash_data = pd.DataFrame({
+    entry['name']: _read_column(column_dir, entry, rows) for entry in entries
+  })
+  return crash_data
+
+def _stream_csv(path, columns, filters, chunksize):
+  """Read the CSV chunk by chunk, keeping only the rows that pass the filters"""
+  usecols = None
+  if columns is not None:
+    usecols = list(columns) + [col for col in (filters or {}) if col not in columns]
+
+  kept = []
+  for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunksize, low_memory=False):
+    if filters:
+      mask = np.ones(len(chunk), dtype=bool)
+      for col, values in filters.items():
+        mask &= chunk[col].isin(values).to_numpy()
+      chunk = chunk[mask]
+    kept.append(chunk)
+
+  crash_data = pd.concat(kept, ignore_index=True)
+  return crash_data if columns is None else crash_data[columns]
+
+def _cache_path(path, cache_dir):
+  """Each source file gets its own cache directory"""
+  stem = os.path.splitext(os.path.basename(path))[0]
+  path_hash = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+  return os.path.join(cache_dir, f'{stem}-{path_hash}')
+
+def _source_signature(path):
+  stat = os.stat(path)
+  return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def _file_hash(path, block_size=1 << 20):
+  digest = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(block_size), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+def _read_manifest(column_dir):
+  manifest_path = os.path.join(column_dir, MANIFEST_NAME)
+  if not os.path.exists(manifest_path):
+    return None
+  with open(manifest_path) as f:
+    return json.load(f)
+
+def _write_manifest(column_dir, manifest):
+  manifest_path = os.path.join(column_dir, MANIFEST_NAME)
+  tmp_path = manifest_path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump(manifest, f, indent=2)
+  os.replace(tmp_path, manifest_path)
+
+def _ensure_cache(path, column_dir):
+  """Return a valid cache manifest, rebuilding the cache if the source changed"""
+  signature = _source_signature(path)
+  manifest = _read_manifest(column_dir)
+
+  if manifest is not None and manifest['source']['size'] == signature['size']:
+    if manifest['source']['mtime_ns'] == signature['mtime_ns']:
+      return manifest
+
+    # Touched but possibly unchanged, so only the content hash can tell
+    if manifest['source']['sha1'] == _file_hash(path):
+      manifest['source']['mtime_ns'] = signature['mtime_ns']
+      _write_manifest(column_dir, manifest)
+      return manifest
+
+  return _build_cache(path, column_dir)
+
+def _build_cache(path, column_dir):
+  """Parse the CSV once and store every column as its own .npy file"""
+  print(f"Building column cache for {path}")
+  if os.path.exists(column_dir):
+    shutil.rmtree(column_dir)
+  os.makedirs(column_dir)
+
+  source = _source_signature(path)
+  source['sha1'] = _file_hash(path)
+  crash_data = pd.read_csv(path, low_memory=False)
+
+  entries = []
+  for i, col in enumerate(crash_data.columns):
+    series = crash_data[col]
+    entry = {'name': col, 'file': f'col_{i}'}
+
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+      entry['kind'] = 'numeric'
+      np.save(os.path.join(column_dir, entry['file'] + '.npy'), series.to_numpy())
+    else:
+      # KABCO severity and the condition columns are stored as codes plus categories
+      entry['kind'] = 'categorical'
+      categorical = pd.Categorical(series)
+      categories = categorical.categories
+      if categories.inferred_type == 'string':
+        categories = categories.to_numpy(dtype=str)
+      else:
+        categories = categories.to_numpy(dtype=object)
+      np.save(os.path.join(column_dir, entry['file'] + '.codes.npy'), categorical.codes)
+      np.save(os.path.join(column_dir, entry['file'] + '.categories.npy'), categories,
+              allow_pickle=True)
+    entries.append(entry)
+
+  manifest = {'source': source, 'n_rows': len(crash_data), 'columns': entries}
+  _write_manifest(column_dir, manifest)
+  return manifest
+
+def _lookup_columns(manifest, columns, path):
+  by_name = {entry['name']: entry for entry in manifest['columns']}
+  missing = [col for col in columns if col not in by_name]
+  if missing:
+    raise KeyError(f"Columns not found in {path}: {missing}")
+  return [by_name[col] for col in columns]
+
+def _apply_filter(column_dir, entry, values, mask, chunksize):
+  """AND one column's isin() test into mask, scanning the memory-mapped column in chunks"""
+  base = os.path.join(column_dir, entry['file'])
+  if entry['kind'] == 'numeric':
+    column = np.load(base + '.npy', mmap_mode='r')
+    allowed = np.asarray(values)
+  else:
+    # Compare category codes instead of strings
+    column = np.load(base + '.codes.npy', mmap_mode='r')
+    categories = np.load(base + '.categories.npy', allow_pickle=True)
+    allowed = np.flatnonzero(pd.Index(categories).isin(values))
+
+  for start in range(0, len(mask), chunksize):
+    stop = start + chunksize
+    mask[start:stop] &= np.isin(column[start:stop], allowed)
+
+def _read_column(column_dir, entry, rows=None):
+  base = os.path.join(column_dir, entry['file'])
+  if entry['kind'] == 'numeric':
+    if rows is None:
+      return np.load(base + '.npy')
+    return np.load(base + '.npy', mmap_mode='r')[rows]
+
+  if rows is None:
+    codes = np.load(base + '.codes.npy')
+  else:
+    codes = np.load(base + '.codes.npy', mmap_mode='r')[rows]
+  categories = np.load(base + '.categories.npy', allow_pickle=True)
+  return pd.Categorical.from_codes(codes, categories=categories)
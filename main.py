@@ -1,79 +1,181 @@
+import argparse
+
+import numpy as np
+
 from load_data import load_data
 from data_exploration import explore_data, visualize_data, correlation_features
-from data_cleaning import def_geo_features, pipline, get_spatial_data
+from data_cleaning import def_geo_features, pipline, get_spatial_data, collapse_locations
 from db_scan import dbscan_clustering, find_optimal_eps
-from data_analysis import analyze_clusters, visualize_cluster_properties
+from data_analysis import SUMMARY_COLUMNS, cluster_summary, visualize_cluster_properties
 from cluster_mapping import plot_clusters, visualize_clusters_map
 from k_means import find_optimal_k, kmeans_clustering
-
-"""Data Exploration"""
-load_crash_data = load_data()
-crash_data = load_crash_data[load_crash_data['Crash Year'].isin([2024, 2025])] # Filter for recent data
-
-explore_data(crash_data=crash_data)
-visualize_data(crash_data=crash_data)
-correlation_features(crash_data=crash_data)
-
-"""Data Cleaning"""
-crash_data_geo = def_geo_features(crash_data=crash_data)
-processed_crash_data = pipline(crash_data_geo=crash_data_geo)
-spatial_data, scaled_coords, original_coords, scaler = get_spatial_data(crash_data_geo=crash_data_geo)
-
-"""Perform First DBScan"""
-first_dbscan, first_cluster_labels = dbscan_clustering(spatial_data=processed_crash_data, eps=0.5, min_samples=10)
-plot_clusters(spatial_data=scaled_coords, original_coords=original_coords, cluster_labels=first_cluster_labels, method_name=first_dbscan)
-
-"""Find Optimal Epsilon and Clustering with both DBScan & K-means"""
-optimal_eps = find_optimal_eps(spatial_data=scaled_coords)
-print(f"Optimal epsilon value for DBSCAN: {optimal_eps:.4f}")
-
-optimal_k = find_optimal_k(spatial_data=scaled_coords)
-print(f"Optimal number of clusters: {optimal_k}")
-
-dbscan, dbscan_labels = dbscan_clustering(spatial_data=scaled_coords, eps=optimal_eps)
-kmeans, kmeans_labels = kmeans_clustering(spatial_data=scaled_coords, n_clusters=optimal_k)
-
-"""Visualize Clusters"""
-print("\nDBSCAN Clustering Results:")
-plot_clusters(spatial_data=scaled_coords, original_coords=original_coords, cluster_labels=dbscan_labels, method_name=dbscan)
-
-print("\nKMeans Clustering Results:")
-plot_clusters(spatial_data=scaled_coords, original_coords=original_coords, cluster_labels=kmeans_labels, method_name=kmeans)
-
-kmeans_map = visualize_clusters_map(original_coords=original_coords, cluster_labels=kmeans_labels, method_name=kmeans)
-kmeans_map
-
-"""Cluster Analysis"""
-dbscan_stats = analyze_clusters(crash_data_geo=crash_data_geo, cluster_labels=dbscan_labels)
-kmeans_stats = analyze_clusters(crash_data_geo=crash_data_geo, cluster_labels=kmeans_labels)
-
-print("DBSCAN Cluster Statistics:")
-for cluster, stats in dbscan_stats.items():
-    print(f"\nCluster {cluster}:")
-    print(f"- Size: {stats['size']} crashes")
-    print(f"- Center: ({stats['center'][0]:.4f}, {stats['center'][1]:.4f})")
-    print(f"- Radius: {stats['radius']:.4f}")
-
-    if stats['severity_counts']:
-        print("- Severity Counts:")
-        for sev, count in stats['severity_counts'].items():
-            print(f"  - {sev}: {count}")
-
-print("\nK-means Cluster Statistics:")
-for cluster, stats in kmeans_stats.items():
-    print(f"\nCluster {cluster}:")
-    print(f"- Size: {stats['size']} crashes")
-    print(f"- Center: ({stats['center'][0]:.4f}, {stats['center'][1]:.4f})")
-    print(f"- Radius: {stats['radius']:.4f}")
-
-    if stats['severity_counts']:
-        print("- Severity Counts:")
-        for sev, count in stats['severity_counts'].items():
-            print(f"  - {sev}: {count}")
-
-print("\nDBSCAN Cluster Analysis:")
-visualize_cluster_properties(crash_data_geo=crash_data_geo, cluster_labels=dbscan_labels)
-print("\nKMeans Cluster Analysis:")
-visualize_cluster_properties(crash_data_geo=crash_data_geo, cluster_labels=kmeans_labels)
-
-
+from report import FigureBatch
+from hotspot_index import build_hotspot_index, save_hotspot_index
+from grid_pyramid import build_grid_pyramid, save_grid_pyramid
+from instrumentation import stage, start_trace, stop_trace, print_trace
+from stage_cache import enable_stage_cache, cached_stage
+from st_dbscan import crash_days
+from cluster_stability import bootstrap_stability
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cluster Virginia crash data with DBSCAN and KMeans")
+    parser.add_argument('--report', metavar='DIR',
+                        help="Write every figure and map to DIR (with an index.html) instead of showing them")
+    parser.add_argument('--hotspot-index', metavar='PATH',
+                        help="Save a hotspot lookup index for the fitted DBSCAN and KMeans models to PATH")
+    parser.add_argument('--trace', metavar='PATH',
+                        help="Record the time, CPU, peak memory and row counts of every stage to a JSON trace")
+    parser.add_argument('--profile', metavar='STAGE', nargs='+', default=[],
+                        help="With --trace, also dump cProfile stats for these stages")
+    parser.add_argument('--coords', choices=['scaled', 'projected'], default='scaled',
+                        help="Cluster standardized lon/lat, or Virginia Lambert coordinates with eps in meters")
+    parser.add_argument('--collapse', metavar='GRID', type=float, nargs='?', const=0,
+                        help="Cluster each distinct location once, weighted by its crash count; with GRID, "
+                             "snap crashes to cells of that side (in --coords units) first")
+    parser.add_argument('--eps-days', metavar='DAYS', type=float,
+                        help="Also run spatio-temporal DBSCAN, with crashes neighbors only within DAYS days")
+    parser.add_argument('--stability', metavar='B', type=int,
+                        help="Report the stability of both clusterings over B subsampled refits")
+    parser.add_argument('--grid-pyramid', metavar='PATH',
+                        help="Aggregate the crashes into a multi-resolution hex grid saved to PATH, "
+                             "and draw the map's heatmap and grid layers from it")
+    parser.add_argument('--stage-cache', action='store_true',
+                        help="Reuse the cleaning, eps/k search and clustering results of earlier runs with the same "
+                             "inputs, code and libraries (stages loaded from the cache print nothing)")
+    args = parser.parse_args()
+
+    # Cleaning, scaling, the eps/k searches and both clusterings are reused across runs with the same inputs
+    if args.stage_cache:
+        enable_stage_cache()
+    if args.trace:
+        start_trace(args.trace, profile=args.profile)
+
+    # Figures are shown as they are made, or rendered headless in parallel at the end with --report
+    figures = FigureBatch(output_dir=args.report)
+
+    """Data Exploration"""
+    with stage('load_data') as s:
+        crash_data = load_data(filters={'Crash Year': [2024, 2025]}) # Filter for recent data
+        s.rows_out = len(crash_data)
+
+    with stage('explore_data', rows_in=len(crash_data)):
+        explore_data(crash_data=crash_data)
+    figures.add('Crash Locations', visualize_data, crash_data=crash_data)
+    figures.add('Feature Correlation', correlation_features, crash_data=crash_data)
+
+    """Data Cleaning"""
+    with stage('def_geo_features', rows_in=len(crash_data)) as s:
+        crash_data_geo = cached_stage('def_geo_features', def_geo_features, crash_data=crash_data)
+        s.rows_out = len(crash_data_geo)
+    with stage('pipline', rows_in=len(crash_data_geo)) as s:
+        processed_crash_data = cached_stage('pipline', pipline, crash_data_geo=crash_data_geo)
+        s.rows_out = processed_crash_data.shape[0]
+    with stage('get_spatial_data', rows_in=len(crash_data_geo)) as s:
+        spatial_data, scaled_coords, original_coords, scaler = cached_stage('get_spatial_data', get_spatial_data,
+                                                                             crash_data_geo=crash_data_geo,
+                                                                             coords=args.coords)
+        s.rows_out = len(scaled_coords)
+
+    # Repeated locations are clustered once with their crash counts as weights; labels map back per crash
+    if args.collapse is not None:
+        with stage('collapse_locations', rows_in=len(scaled_coords)) as s:
+            cluster_coords, location_weights, location_index = collapse_locations(scaled_coords,
+                                                                                  grid_size=args.collapse or None)
+            s.rows_out = len(cluster_coords)
+    else:
+        cluster_coords, location_weights, location_index = scaled_coords, None, None
+
+    """Perform First DBScan"""
+    with stage('first dbscan_clustering', rows_in=processed_crash_data.shape[0]):
+        first_dbscan, first_cluster_labels = cached_stage('first dbscan_clustering', dbscan_clustering,
+                                                           spatial_data=processed_crash_data, eps=0.5, min_samples=10)
+    figures.add('First DBSCAN Clusters', plot_clusters, spatial_data=scaled_coords, original_coords=original_coords,
+                cluster_labels=first_cluster_labels, method_name=first_dbscan, scaler=scaler)
+
+    """Find Optimal Epsilon and Clustering with both DBScan & K-means"""
+    with stage('find_optimal_eps', rows_in=len(cluster_coords)):
+        optimal_eps = cached_stage('find_optimal_eps', find_optimal_eps, spatial_data=cluster_coords,
+                                   sample_weight=location_weights)
+    print(f"Optimal epsilon value for DBSCAN: {optimal_eps:.4f}" + (" m" if args.coords == 'projected' else ""))
+
+    with stage('find_optimal_k', rows_in=len(cluster_coords)):
+        optimal_k = cached_stage('find_optimal_k', find_optimal_k, spatial_data=cluster_coords,
+                                 sample_weight=location_weights)
+    print(f"Optimal number of clusters: {optimal_k}")
+
+    with stage('dbscan_clustering', rows_in=len(cluster_coords)):
+        dbscan, dbscan_labels = cached_stage('dbscan_clustering', dbscan_clustering,
+                                              spatial_data=cluster_coords, eps=optimal_eps,
+                                              sample_weight=location_weights)
+    with stage('kmeans_clustering', rows_in=len(cluster_coords)):
+        kmeans, kmeans_labels = cached_stage('kmeans_clustering', kmeans_clustering,
+                                              spatial_data=cluster_coords, n_clusters=optimal_k,
+                                              sample_weight=location_weights)
+    if location_index is not None:
+        dbscan_labels, kmeans_labels = dbscan_labels[location_index], kmeans_labels[location_index]
+
+    if args.eps_days:
+        with stage('st_dbscan_clustering', rows_in=len(scaled_coords)):
+            st_data = np.column_stack([scaled_coords, crash_days(crash_data.loc[crash_data_geo.index])])
+            st_dbscan, st_dbscan_labels = cached_stage('st_dbscan_clustering', dbscan_clustering,
+                                                        spatial_data=st_data, eps=optimal_eps,
+                                                        algorithm='st', eps_time=args.eps_days)
+
+    if args.stability:
+        for name, labels, options in [('DBSCAN', dbscan_labels, {'method': 'dbscan', 'eps': optimal_eps}),
+                                      ('KMeans', kmeans_labels, {'method': 'kmeans'})]:
+            stability = bootstrap_stability(scaled_coords, labels, n_resamples=args.stability, **options)
+            print(f"\n{name} cluster stability over {stability['n_resamples']} refits:")
+            print(stability['clusters'].to_string(index=False, float_format='{:.3f}'.format))
+
+    if args.hotspot_index:
+        with stage('save_hotspot_index'):
+            save_hotspot_index(build_hotspot_index(scaler, kmeans=kmeans, dbscan=dbscan), args.hotspot_index)
+
+    pyramid = None
+    if args.grid_pyramid:
+        with stage('build_grid_pyramid', rows_in=len(crash_data_geo)):
+            pyramid = build_grid_pyramid(crash_data_geo)
+            save_grid_pyramid(pyramid, args.grid_pyramid)
+
+    """Visualize Clusters"""
+    print("\nDBSCAN Clustering Results:")
+    figures.add('DBSCAN Clusters', plot_clusters, spatial_data=scaled_coords, original_coords=original_coords,
+                cluster_labels=dbscan_labels, method_name=dbscan, scaler=scaler)
+
+    if args.eps_days:
+        figures.add('ST-DBSCAN Clusters', plot_clusters, spatial_data=scaled_coords, original_coords=original_coords,
+                    cluster_labels=st_dbscan_labels, method_name=st_dbscan, scaler=scaler)
+
+    print("\nKMeans Clustering Results:")
+    figures.add('KMeans Clusters', plot_clusters, spatial_data=scaled_coords, original_coords=original_coords,
+                cluster_labels=kmeans_labels, method_name=kmeans, scaler=scaler)
+
+    figures.add('KMeans Map', visualize_clusters_map,
+                original_coords=original_coords, cluster_labels=kmeans_labels, method_name=kmeans, pyramid=pyramid)
+
+    """Cluster Analysis"""
+    with stage('cluster_summary', rows_in=len(crash_data_geo)):
+        dbscan_summary = cluster_summary(crash_data_geo=crash_data_geo, cluster_labels=dbscan_labels)
+        kmeans_summary = cluster_summary(crash_data_geo=crash_data_geo, cluster_labels=kmeans_labels)
+
+    print("DBSCAN Cluster Statistics:")
+    print(dbscan_summary[SUMMARY_COLUMNS + ['Crash Severity']].to_string(float_format='{:.4f}'.format))
+
+    print("\nK-means Cluster Statistics:")
+    print(kmeans_summary[SUMMARY_COLUMNS + ['Crash Severity']].to_string(float_format='{:.4f}'.format))
+
+    print("\nDBSCAN Cluster Analysis:")
+    figures.add('DBSCAN Cluster Properties', visualize_cluster_properties,
+                crash_data_geo=crash_data_geo, cluster_labels=dbscan_labels)
+    print("\nKMeans Cluster Analysis:")
+    figures.add('KMeans Cluster Properties', visualize_cluster_properties,
+                crash_data_geo=crash_data_geo, cluster_labels=kmeans_labels)
+
+    index_path = figures.render()
+    if index_path:
+        print(f"\nReport written to {index_path}")
+
+    if args.trace:
+        print_trace(stop_trace())
+        print(f"Trace written to {args.trace}")
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+# GRS80 ellipsoid (NAD83)
+_A = 6378137.0
+_F = 1 / 298.257222101
+_E = np.sqrt(2 * _F - _F ** 2)
+
+class VirginiaLambert:
+    """Lon/lat to Virginia Lambert (EPSG:3968) planar coordinates in meters
+
+    A vectorized Lambert Conformal Conic projection on NAD83 with standard
+    parallels 37N and 39.5N, origin 36N 79.5W and no false easting/northing.
+    Scale error stays within about 0.05% across the state, so Euclidean
+    distances between projected points are distances in meters. Follows the
+    scaler interface (fit, transform, inverse_transform), so it can stand in
+    for the StandardScaler returned by get_spatial_data.
+    """
+
+    def __init__(self, lat_1=37.0, lat_2=39.5, lat_0=36.0, lon_0=-79.5):
+        self.lat_1 = lat_1
+        self.lat_2 = lat_2
+        self.lat_0 = lat_0
+        self.lon_0 = lon_0
+
+        phi_1, phi_2, phi_0 = np.radians([lat_1, lat_2, lat_0])
+        m_1, m_2 = _m(phi_1), _m(phi_2)
+        t_1, t_2 = _t(phi_1), _t(phi_2)
+        self._n = np.log(m_1 / m_2) / np.log(t_1 / t_2)
+        self._af = _A * m_1 / (self._n * t_1 ** self._n)
+        self._rho_0 = self._af * _t(phi_0) ** self._n
+
+    def fit(self, X, y=None):
+        # Nothing to learn; only the input's column names are kept, as sklearn does
+        if isinstance(X, pd.DataFrame):
+            self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+        return self
+
+    def fit_transform(self, X, y=None):
+        return self.fit(X).transform(X)
+
+    def transform(self, X):
+        """(lon, lat) rows to (easting, northing) rows in meters"""
+        X = np.asarray(X, dtype=np.float64)
+        lam, phi = np.radians(X[:, 0]), np.radians(X[:, 1])
+
+        rho = self._af * _t(phi) ** self._n
+        theta = self._n * (lam - np.radians(self.lon_0))
+        return np.column_stack([rho * np.sin(theta), self._rho_0 - rho * np.cos(theta)])
+
+    def inverse_transform(self, X):
+        """(easting, northing) rows in meters back to (lon, lat) rows"""
+        X = np.asarray(X, dtype=np.float64)
+        easting, northing = X[:, 0], self._rho_0 - X[:, 1]
+
+        rho = np.hypot(easting, northing)
+        theta = np.arctan2(easting, northing)
+        t = (rho / self._af) ** (1 / self._n)
+
+        # The latitude has no closed form; this fixed point converges to < 1e-12 rad in a few steps
+        phi = np.pi / 2 - 2 * np.arctan(t)
+        for _ in range(8):
+            sin_phi = _E * np.sin(phi)
+            phi = np.pi / 2 - 2 * np.arctan(t * ((1 - sin_phi) / (1 + sin_phi)) ** (_E / 2))
+
+        lon = np.degrees(theta / self._n) + self.lon_0
+        return np.column_stack([lon, np.degrees(phi)])
+
+def _m(phi):
+    return np.cos(phi) / np.sqrt(1 - (_E * np.sin(phi)) ** 2)
+
+def _t(phi):
+    sin_phi = _E * np.sin(phi)
+    return np.tan(np.pi / 4 - phi / 2) / ((1 - sin_phi) / (1 + sin_phi)) ** (_E / 2)
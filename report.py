@@ -0,0 +1,113 @@
+import html
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib.pyplot as plt
+
+from instrumentation import stage
+
+# Set while figures are being written to a report directory instead of shown
+_report = None
+
+def show_figure():
+    """plt.show(), or in report mode save the current figure to the report directory"""
+    if _report is None:
+        plt.show()
+        return
+
+    fig = plt.gcf()
+    title = fig.get_suptitle() or (fig.axes[0].get_title() if fig.axes else '')
+    _report['count'] += 1
+    filename = f"{_report['prefix']}_{_report['count']:02d}_{_slug(title)}.png"
+    fig.savefig(os.path.join(_report['dir'], filename), dpi=120)
+    plt.close(fig)
+    _report['files'].append((title or filename, filename))
+
+def start_report(output_dir, prefix='figure'):
+    """Switch to a non-interactive backend and save every following figure under output_dir"""
+    global _report
+    plt.switch_backend('Agg')
+    os.makedirs(output_dir, exist_ok=True)
+    _report = {'dir': output_dir, 'prefix': prefix, 'count': 0, 'files': []}
+
+def stop_report():
+    """Leave report mode, returning the (title, filename) of every saved figure"""
+    global _report
+    files = _report['files'] if _report is not None else []
+    _report = None
+    plt.close('all')
+    return files
+
+class FigureBatch:
+    """Plotting calls to run now, or to render headless into a report
+
+    Without an output_dir each add() runs immediately, so figures are shown as
+    before. With one, add() only queues the call; render() then runs the queued
+    calls in a process pool, saves every figure (and any returned folium map)
+    to output_dir and writes an index.html linking them.
+    """
+
+    def __init__(self, output_dir=None, max_workers=None):
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        self.tasks = []
+
+    def add(self, name, func, **kwargs):
+        if self.output_dir is None:
+            with stage(f'figure {name}'):
+                return func(**kwargs)
+        self.tasks.append((name, func, kwargs))
+
+    def render(self, title='Crash Clustering Report'):
+        """Render the queued figures and return the path of the index file"""
+        if self.output_dir is None:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        with stage('render report'), ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(_render_task, self.output_dir, name, func, kwargs)
+                for name, func, kwargs in self.tasks
+            ]
+            sections = [(name, future.result()) for (name, _, _), future in zip(self.tasks, futures)]
+
+        self.tasks = []
+        return _write_index(self.output_dir, title, sections)
+
+def _render_task(output_dir, name, func, kwargs):
+    start_report(output_dir, prefix=_slug(name))
+    try:
+        result = func(**kwargs)
+        if hasattr(result, 'save') and hasattr(result, 'get_root'):
+            filename = f"{_slug(name)}.html"
+            result.save(os.path.join(output_dir, filename))
+            _report['files'].append((name, filename))
+    finally:
+        files = stop_report()
+    return files
+
+def _write_index(output_dir, title, sections):
+    lines = [
+        '<!DOCTYPE html>',
+        f'<html><head><meta charset="utf-8"><title>{html.escape(title)}</title></head><body>',
+        f'<h1>{html.escape(title)}</h1>',
+    ]
+    for name, files in sections:
+        lines.append(f'<h2>{html.escape(name)}</h2>')
+        for caption, filename in files:
+            href = html.escape(filename)
+            if filename.endswith('.html'):
+                lines.append(f'<p><a href="{href}">{html.escape(caption)} (interactive map)</a></p>')
+            else:
+                lines.append(f'<figure><a href="{href}"><img src="{href}" width="800"></a>'
+                             f'<figcaption>{html.escape(caption)}</figcaption></figure>')
+    lines.append('</body></html>')
+
+    index_path = os.path.join(output_dir, 'index.html')
+    with open(index_path, 'w') as f:
+        f.write('\n'.join(lines))
+    return index_path
+
+def _slug(text):
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')[:60] or 'figure'
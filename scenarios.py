@@ -0,0 +1,128 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+from load_data import load_data
+from data_cleaning import GEO_FEATURES, def_geo_features, get_spatial_data
+from k_means import find_optimal_k, kmeans_clustering
+from instrumentation import stage, start_trace, stop_trace, tracing, add_records
+
+SCENARIO_YEARS = [2024, 2025]
+
+# Scenarios filter on a condition, so that condition is left out of the features
+_NO_LIGHT = [col for col in GEO_FEATURES if col != "Light Condition"]
+_NO_SURFACE = [col for col in GEO_FEATURES if col not in ("Roadway Surface Condition", "Roadway Alignment")]
+
+SCENARIOS = [
+    {'name': 'Daylight',
+     'filters': {'Light Condition': ['2. Daylight']},
+     'geo_features': _NO_LIGHT},
+    {'name': 'Non-Daylight',
+     'filters': {'Light Condition': ['1. Dawn', '3. Dusk',
+                                     '4. Darkness - Road Lighted',
+                                     '5. Darkness - Road Not Lighted']},
+     'geo_features': _NO_LIGHT},
+    {'name': 'Dry',
+     'filters': {'Roadway Surface Condition': ['1. Dry']},
+     'geo_features': _NO_SURFACE},
+    {'name': 'Wet',
+     'filters': {'Roadway Surface Condition': ['2. Wet']},
+     'geo_features': _NO_SURFACE},
+    {'name': 'Intoxicated',
+     'filters': {'Alcohol?': ['Yes']},
+     'geo_features': GEO_FEATURES},
+    {'name': 'Distracted',
+     'filters': {'Distracted?': ['Yes']},
+     'geo_features': GEO_FEATURES},
+    {'name': 'Unbelted',
+     'filters': {'Unrestrained?': ['Unbelted']},
+     'geo_features': GEO_FEATURES},
+    {'name': 'Belted',
+     'filters': {'Unrestrained?': ['Belted']},
+     'geo_features': GEO_FEATURES},
+]
+
+def load_scenario_data(scenarios=SCENARIOS, years=SCENARIO_YEARS):
+    """Load, in one pass, every column any of the scenarios needs"""
+    columns = []
+    for scenario in scenarios:
+        for col in list(scenario['geo_features']) + list(scenario['filters']):
+            if col not in columns:
+                columns.append(col)
+
+    return load_data(columns=columns, filters={'Crash Year': years})
+
+def select_scenario(crash_data, scenario):
+    """Rows of crash_data matching every filter of the scenario"""
+    mask = np.ones(len(crash_data), dtype=bool)
+    for col, values in scenario['filters'].items():
+        mask &= crash_data[col].isin(values).to_numpy()
+
+    return crash_data[mask]
+
+def run_scenario(crash_data, scenario, n_jobs=-1):
+    """Cluster one scenario's crashes with KMeans and return the results as a dict"""
+    with stage('def_geo_features', rows_in=len(crash_data)) as s:
+        crash_data_geo = def_geo_features(crash_data=crash_data, geo_features=scenario['geo_features'])
+        s.rows_out = len(crash_data_geo)
+    with stage('get_spatial_data', rows_in=len(crash_data_geo)) as s:
+        spatial_data, scaled_coords, original_coords, scaler = get_spatial_data(crash_data_geo=crash_data_geo)
+        s.rows_out = len(scaled_coords)
+
+    with stage('find_optimal_k', rows_in=len(scaled_coords)):
+        optimal_k = find_optimal_k(spatial_data=scaled_coords, n_jobs=n_jobs)
+    with stage('kmeans_clustering', rows_in=len(scaled_coords)) as s:
+        kmeans, kmeans_labels = kmeans_clustering(spatial_data=scaled_coords, n_clusters=optimal_k)
+        s.rows_out = len(kmeans_labels)
+
+    return {
+        'name': scenario['name'],
+        'n_crashes': len(crash_data_geo),
+        'optimal_k': optimal_k,
+        'kmeans': kmeans,
+        'labels': kmeans_labels,
+        'scaler': scaler,
+        'scaled_coords': scaled_coords,
+        'original_coords': original_coords,
+        'crash_data_geo': crash_data_geo,
+    }
+
+def _run_scenario_worker(crash_data, scenario, n_threads, trace=False):
+    # Keep each worker's BLAS/OpenMP threads within its share of the cores, and
+    # run its k sweep in-process since the scenarios already fill the pool
+    if trace:
+        start_trace()
+    with threadpool_limits(limits=n_threads), stage(f"scenario {scenario['name']}", rows_in=len(crash_data)):
+        result = run_scenario(crash_data, scenario, n_jobs=1)
+    # The worker's stage records travel back with the result
+    result['trace'] = stop_trace() if trace else []
+    return result
+
+def run_scenarios(scenarios=SCENARIOS, crash_data=None, max_workers=None):
+    """Run every scenario in a process pool, loading the data only once
+
+    Returns a dict of scenario name to the result of run_scenario. Nothing is
+    plotted here, so callers decide when (and whether) to show figures.
+    """
+    if crash_data is None:
+        with stage('load_scenario_data') as s:
+            crash_data = load_scenario_data(scenarios)
+            s.rows_out = len(crash_data)
+
+    if max_workers is None:
+        max_workers = min(len(scenarios), os.cpu_count() or 1)
+    n_threads = max(1, (os.cpu_count() or 1) // max_workers)
+
+    with stage('run_scenarios', rows_in=len(crash_data)), ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_run_scenario_worker, select_scenario(crash_data, scenario), scenario, n_threads,
+                            tracing())
+            for scenario in scenarios
+        ]
+        results = [future.result() for future in futures]
+        for result in results:
+            add_records(result.pop('trace'))
+
+    return {result['name']: result for result in results}
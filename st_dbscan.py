@@ -0,0 +1,199 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.cluster import DBSCAN
+from sklearn.neighbors import KDTree, sort_graph_by_row_values
+
+from load_data import load_data
+from data_cleaning import GEO_FEATURES, def_geo_features, get_spatial_data
+
+DATE_COLUMN = 'Crash Date'
+
+class STDBSCAN:
+    """Spatio-temporal DBSCAN over rows of (x, y, time in days)
+
+    Two crashes are neighbors when they are within eps in space and within
+    eps_time days of each other, so the same spot hit two years apart no
+    longer counts twice towards min_samples. Neighbors come from a
+    TimeBucketIndex, and the clustering itself is sklearn's DBSCAN on the
+    resulting sparse neighbor graph.
+    """
+
+    def __init__(self, eps=0.5, eps_time=30.0, min_samples=5):
+        self.eps = eps
+        self.eps_time = eps_time
+        self.min_samples = min_samples
+
+    def fit(self, X, y=None, sample_weight=None):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != 3:
+            raise ValueError(f"STDBSCAN needs (x, y, time) rows, got shape {X.shape}")
+
+        index = TimeBucketIndex(X[:, :2], X[:, 2], self.eps, self.eps_time)
+        positions, graph = index.window_graph(-np.inf, np.inf)
+        labels, core = _cluster_graph(graph, self.eps, self.min_samples,
+                                      None if sample_weight is None else np.asarray(sample_weight)[positions])
+
+        self.labels_ = np.full(len(X), -1, dtype=np.int64)
+        self.labels_[positions] = labels
+        self.core_sample_indices_ = np.sort(positions[core])
+        self.components_ = X[self.core_sample_indices_].copy()
+        return self
+
+    def fit_predict(self, X, y=None, sample_weight=None):
+        return self.fit(X, sample_weight=sample_weight).labels_
+
+class TimeBucketIndex:
+    """Spatial neighbor pairs within eps_time days, found one time bucket at a time
+
+    Points are sorted by time and cut into buckets eps_time days wide, so a
+    point's temporal neighbors lie in its own bucket or the next one. The pairs
+    starting in a bucket come from one KD-tree over that bucket and the next,
+    and are kept until release() drops them, so overlapping windows reuse
+    them instead of searching again.
+    """
+
+    def __init__(self, coords, times, eps, eps_time):
+        self.eps = eps
+        self.eps_time = eps_time
+        times = np.asarray(times, dtype=np.float64)
+        self.order = np.argsort(times, kind='stable')
+        self.times = times[self.order]
+        self.coords = np.asarray(coords, dtype=np.float64)[self.order]
+
+        self._buckets = np.floor((self.times - self.times[0]) / eps_time).astype(np.int64) if len(times) else times
+        n_buckets = int(self._buckets[-1]) + 1 if len(times) else 0
+        self._bucket_start = np.searchsorted(self._buckets, np.arange(n_buckets + 2))
+        self._pairs = {}
+
+    def window_graph(self, start, end):
+        """Original indices of the points with start <= time < end, and their neighbor graph
+
+        The graph is a symmetric CSR matrix of spatial distances between
+        neighbors, in the order of the returned indices.
+        """
+        lo, hi = np.searchsorted(self.times, [start, end], side='left')
+        parts = [self._bucket_pairs(b) for b in range(*self._bucket_range(lo, hi))]
+        if parts:
+            first, second, dist = (np.concatenate(arrays) for arrays in zip(*parts))
+            keep = (first >= lo) & (second < hi)
+            first, second, dist = first[keep] - lo, second[keep] - lo, dist[keep]
+        else:
+            first = second = np.zeros(0, dtype=np.int64)
+            dist = np.zeros(0)
+
+        n_points = hi - lo
+        # Zero distances (repeat crashes at one spot, and each point to itself) stay as explicit entries
+        diagonal = np.arange(n_points)
+        graph = csr_matrix((np.concatenate([dist, dist, np.zeros(n_points)]),
+                            (np.concatenate([first, second, diagonal]), np.concatenate([second, first, diagonal]))),
+                           shape=(n_points, n_points))
+        return self.order[lo:hi], graph
+
+    def release(self, before):
+        """Forget the pairs stored for buckets before the one holding time `before`"""
+        first_kept = np.searchsorted(self.times, before, side='left')
+        if first_kept < len(self.times):
+            keep_from = self._buckets[first_kept]
+            for bucket in [b for b in self._pairs if b < keep_from]:
+                del self._pairs[bucket]
+
+    def _bucket_range(self, lo, hi):
+        if hi <= lo:
+            return 0, 0
+        # Pairs are stored under their earlier point's bucket, so lo's bucket is the first needed
+        return int(self._buckets[lo]), int(self._buckets[hi - 1]) + 1
+
+    def _bucket_pairs(self, bucket):
+        """(first, second, distance) of every neighbor pair whose earlier point is in bucket"""
+        if bucket not in self._pairs:
+            start, mid, stop = self._bucket_start[bucket:bucket + 3]
+            if mid == start:
+                pairs = (np.zeros(0, dtype=np.int64),) * 2 + (np.zeros(0),)
+            else:
+                tree = KDTree(self.coords[start:stop])
+                neighbors, distances = tree.query_radius(self.coords[start:mid], r=self.eps,
+                                                         return_distance=True)
+                counts = np.array([len(n) for n in neighbors])
+                first = np.repeat(np.arange(mid - start), counts)
+                second = np.concatenate(neighbors)
+                dist = np.concatenate(distances)
+
+                # Each pair once (first < second, which also drops self-pairs), within eps_time
+                first, second = first + start, second + start
+                keep = (second > first) & (self.times[second] - self.times[first] <= self.eps_time)
+                pairs = (first[keep], second[keep], dist[keep])
+            self._pairs[bucket] = pairs
+        return self._pairs[bucket]
+
+def rolling_st_dbscan(coords, times, window, step, eps, eps_time=30.0, min_samples=5,
+                      start=None, end=None, sample_weight=None):
+    """ST-DBSCAN over rolling windows of `window` days advanced by `step` days
+
+    Yields a dict per window with its start and end day, the original indices
+    of its crashes and their cluster labels. All windows share one
+    TimeBucketIndex, so neighbor pairs are searched once per time bucket however
+    much the windows overlap, and buckets the windows have passed are released
+    to keep memory bounded.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    index = TimeBucketIndex(coords, times, eps, eps_time)
+    start = float(np.min(times)) if start is None else start
+    end = float(np.max(times)) + 1 if end is None else end
+
+    while start < end:
+        index.release(start)
+        positions, graph = index.window_graph(start, start + window)
+        labels, _ = _cluster_graph(graph, eps, min_samples,
+                                   None if sample_weight is None else np.asarray(sample_weight)[positions])
+        yield {'start': start, 'end': start + window, 'indices': positions, 'labels': labels}
+        if start + window >= end:
+            break
+        start += step
+
+def crash_days(crash_data, column=DATE_COLUMN):
+    """Crash dates as float days since 1970-01-01"""
+    dates = pd.to_datetime(crash_data[column])
+    return ((dates - pd.Timestamp('1970-01-01')) / pd.Timedelta(days=1)).to_numpy(dtype=np.float64)
+
+def _cluster_graph(graph, eps, min_samples, sample_weight=None):
+    if graph.shape[0] == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    dbscan = DBSCAN(eps=eps, min_samples=min_samples, metric='precomputed')
+    graph = sort_graph_by_row_values(graph, warn_when_not_sorted=False)
+    labels = dbscan.fit_predict(graph, sample_weight=sample_weight)
+    return labels, dbscan.core_sample_indices_
+
+def _date(day):
+    return (pd.Timestamp('1970-01-01') + pd.Timedelta(days=day)).date()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find emerging crash hotspots with ST-DBSCAN over rolling windows")
+    parser.add_argument('--years', type=int, nargs='+', default=[2022, 2023, 2024, 2025])
+    parser.add_argument('--eps', type=float, default=150.0, help="Spatial eps in meters")
+    parser.add_argument('--eps-days', type=float, default=30.0, help="Temporal eps in days")
+    parser.add_argument('--min-samples', type=int, default=10)
+    parser.add_argument('--window-days', type=float, default=365.0)
+    parser.add_argument('--step-days', type=float, default=91.0)
+    args = parser.parse_args()
+
+    crash_data = load_data(columns=GEO_FEATURES + [DATE_COLUMN], filters={'Crash Year': args.years})
+    crash_data_geo = def_geo_features(crash_data)
+    _, projected_coords, _, _ = get_spatial_data(crash_data_geo, coords='projected')
+    times = crash_days(crash_data.loc[crash_data_geo.index])
+
+    rows = []
+    for result in rolling_st_dbscan(projected_coords, times, args.window_days, args.step_days, args.eps,
+                                    eps_time=args.eps_days, min_samples=args.min_samples):
+        labels = result['labels']
+        clustered = labels >= 0
+        rows.append({
+            'start': _date(result['start']),
+            'end': _date(result['end']),
+            'crashes': len(labels),
+            'clusters': len(np.unique(labels[clustered])),
+            'clustered_share': clustered.mean() if len(labels) else np.nan,
+        })
+    print(pd.DataFrame(rows).to_string(index=False, float_format='{:.3f}'.format))
@@ -0,0 +1,267 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import tempfile
+import weakref
+from datetime import datetime
+from importlib.metadata import PackageNotFoundError, version
+
+import joblib
+import numpy as np
+import pandas as pd
+
+STAGE_CACHE_DIR = '.stage_cache'
+STAGE_CACHE_MAX_BYTES = 4 * 2**30
+
+# Libraries whose upgrades can change a stage's result
+STAGE_LIBRARIES = ('numpy', 'pandas', 'scipy', 'scikit-learn', 'joblib', 'kneed')
+
+# Modules that only draw figures and maps or drive the pipeline; editing them never changes a stage's result
+PRESENTATION_MODULES = ('report', 'cluster_mapping', 'data_exploration', 'main', '__main__')
+
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Set while stage results are cached on disk; None runs every stage
+_cache = None
+
+def enable_stage_cache(cache_dir=STAGE_CACHE_DIR, max_bytes=STAGE_CACHE_MAX_BYTES):
+    """Cache the results of every following cached_stage call under cache_dir"""
+    global _cache
+    os.makedirs(cache_dir, exist_ok=True)
+    _cache = {'dir': cache_dir, 'max_bytes': max_bytes, 'derived': {}, 'sources': {},
+              'libraries': _library_versions()}
+
+def disable_stage_cache():
+    global _cache
+    _cache = None
+
+def cached_stage(name, func, **kwargs):
+    """func(**kwargs), or its stored result for the same inputs and code
+
+    The key hashes the stage name and function, every argument, the installed
+    versions of STAGE_LIBRARIES and the source of func's module and of every
+    repository module it imports, directly or through other repository modules
+    (so editing any function a stage calls invalidates it). The modules in
+    PRESENTATION_MODULES are left out, so editing the maps or figures keeps
+    every cached stage. Results
+    that came out of an earlier cached stage are identified by that stage's key
+    rather than rehashed, so only the first input of a chain (the loaded crash
+    data) is hashed in full. Arrays are stored as .npy and anything else with
+    joblib. A hit skips func entirely, including anything it would print.
+    Results must not be modified in place, since their key would go stale.
+    """
+    if _cache is None:
+        return func(**kwargs)
+
+    key = _stage_key(name, func, kwargs)
+    entry_dir = os.path.join(_cache['dir'], key)
+    if os.path.isdir(entry_dir):
+        try:
+            result = _read_entry(entry_dir)
+        except (OSError, ValueError, EOFError):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        else:
+            # Touching the metadata marks the entry as recently used for eviction
+            os.utime(os.path.join(entry_dir, 'meta.json'))
+            print(f"Loaded {name} from the stage cache ({key[:12]})")
+            _register(result, key)
+            return result
+
+    result = func(**kwargs)
+    _write_entry(entry_dir, name, result)
+    _register(result, key)
+    evict(_cache['dir'], _cache['max_bytes'])
+    return result
+
+def fingerprint(value):
+    """Content hash of a stage input"""
+    if _cache is not None:
+        known = _cache['derived'].get(id(value))
+        if known is not None and known[0]() is value:
+            return known[1]
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        # joblib.hash pickles object columns value by value, which is far slower
+        digest = hashlib.sha1(pd.util.hash_pandas_object(value, index=True).to_numpy())
+        columns = value.columns if isinstance(value, pd.DataFrame) else [value.name]
+        dtypes = value.dtypes if isinstance(value, pd.DataFrame) else [value.dtype]
+        digest.update(repr((list(columns), [str(dtype) for dtype in dtypes])).encode())
+        return digest.hexdigest()
+    if isinstance(value, (list, tuple)):
+        return joblib.hash([fingerprint(item) for item in value])
+    if isinstance(value, dict):
+        return joblib.hash({k: fingerprint(v) for k, v in value.items()})
+    return joblib.hash(value)
+
+def cache_entries(cache_dir=STAGE_CACHE_DIR):
+    """DataFrame of the stored entries, most recently used first"""
+    rows = []
+    if os.path.isdir(cache_dir):
+        for key in os.listdir(cache_dir):
+            meta_path = os.path.join(cache_dir, key, 'meta.json')
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                last_used = os.path.getmtime(meta_path)
+            except (OSError, ValueError):
+                continue
+            rows.append({
+                'key': key,
+                'stage': meta['stage'],
+                'size_mb': meta['bytes'] / 2**20,
+                'created': meta['created'],
+                'last_used': datetime.fromtimestamp(last_used).isoformat(timespec='seconds'),
+                '_last_used': last_used,
+                '_bytes': meta['bytes'],
+            })
+
+    columns = ['key', 'stage', 'size_mb', 'created', 'last_used', '_last_used', '_bytes']
+    entries = pd.DataFrame(rows, columns=columns)
+    return entries.sort_values('_last_used', ascending=False, ignore_index=True)
+
+def evict(cache_dir=STAGE_CACHE_DIR, max_bytes=STAGE_CACHE_MAX_BYTES):
+    """Remove the least recently used entries until the cache fits in max_bytes"""
+    entries = cache_entries(cache_dir)
+    kept = entries['_bytes'].cumsum() <= max_bytes
+    for key in entries.loc[~kept, 'key']:
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+    return int((~kept).sum())
+
+def clear_cache(cache_dir=STAGE_CACHE_DIR, stage=None):
+    """Remove every entry, or only those of one stage"""
+    entries = cache_entries(cache_dir)
+    if stage is not None:
+        entries = entries[entries['stage'] == stage]
+    for key in entries['key']:
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+    return len(entries)
+
+def _stage_key(name, func, kwargs):
+    digest = hashlib.sha1(name.encode())
+    digest.update(f"{func.__module__}.{func.__qualname__}".encode())
+    digest.update(_cache['libraries'].encode())
+    for module in sorted(_stage_modules(func), key=lambda module: module.__name__):
+        digest.update(module.__name__.encode())
+        digest.update(_module_source_hash(module).encode())
+    for arg, value in sorted(kwargs.items()):
+        digest.update(arg.encode())
+        digest.update(fingerprint(value).encode())
+    return digest.hexdigest()
+
+def _stage_modules(func):
+    """func's module and the repository modules it reaches through imports, minus PRESENTATION_MODULES"""
+    found = {}
+    pending = [sys.modules[func.__module__]]
+    while pending:
+        module = pending.pop()
+        if module.__name__ in found:
+            continue
+        found[module.__name__] = module
+        for value in vars(module).values():
+            # Both "import x" and "from x import y" leave a trace in the importing module's globals
+            if inspect.ismodule(value):
+                imported = value
+            else:
+                name = getattr(value, '__module__', None)
+                imported = sys.modules.get(name) if isinstance(name, str) else None
+            if (imported is not None and imported.__name__ not in found
+                    and imported.__name__ not in PRESENTATION_MODULES and _in_repo(imported)):
+                pending.append(imported)
+    return list(found.values())
+
+def _in_repo(module):
+    path = getattr(module, '__file__', None)
+    return path is not None and os.path.dirname(os.path.abspath(path)) == _REPO_DIR
+
+def _module_source_hash(module):
+    known = _cache['sources'].get(module.__name__)
+    if known is None:
+        with open(module.__file__, 'rb') as f:
+            known = hashlib.sha1(f.read()).hexdigest()
+        _cache['sources'][module.__name__] = known
+    return known
+
+def _library_versions():
+    versions = []
+    for library in STAGE_LIBRARIES:
+        try:
+            versions.append(f"{library}=={version(library)}")
+        except PackageNotFoundError:
+            versions.append(f"{library} missing")
+    return ' '.join(versions)
+
+def _register(result, key):
+    # Later stages fed with these objects reuse the key instead of rehashing them
+    items = [(result, key)]
+    if isinstance(result, tuple):
+        items += [(item, f"{key}:{i}") for i, item in enumerate(result)]
+    for item, item_key in items:
+        try:
+            _cache['derived'][id(item)] = (weakref.ref(item), item_key)
+        except TypeError:
+            pass  # ints, lists and tuples can't be weakly referenced, and are cheap to hash
+
+def _write_entry(entry_dir, name, result):
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir), prefix='.tmp-')
+    try:
+        is_tuple = isinstance(result, tuple)
+        for i, item in enumerate(result if is_tuple else (result,)):
+            if isinstance(item, np.ndarray) and item.dtype != object:
+                np.save(os.path.join(tmp_dir, f'{i}.npy'), item)
+            else:
+                joblib.dump(item, os.path.join(tmp_dir, f'{i}.joblib'))
+
+        size = sum(os.path.getsize(os.path.join(tmp_dir, f)) for f in os.listdir(tmp_dir))
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({
+                'stage': name,
+                'tuple': is_tuple,
+                'items': len(result) if is_tuple else 1,
+                'bytes': size,
+                'created': datetime.now().isoformat(timespec='seconds'),
+            }, f)
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # Another run stored the same entry first, or the disk is full; the result is still returned
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def _read_entry(entry_dir):
+    with open(os.path.join(entry_dir, 'meta.json')) as f:
+        meta = json.load(f)
+
+    items = []
+    for i in range(meta['items']):
+        npy_path = os.path.join(entry_dir, f'{i}.npy')
+        if os.path.exists(npy_path):
+            items.append(np.load(npy_path))
+        else:
+            items.append(joblib.load(os.path.join(entry_dir, f'{i}.joblib')))
+    return tuple(items) if meta['tuple'] else items[0]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspect and clear the pipeline stage cache")
+    parser.add_argument('--cache-dir', default=STAGE_CACHE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('list', help="List the cached stage results, most recently used first")
+
+    clear_parser = commands.add_parser('clear', help="Remove cached results")
+    clear_parser.add_argument('--stage', help="Only remove the results of this stage")
+
+    prune_parser = commands.add_parser('prune', help="Evict least recently used results down to a size")
+    prune_parser.add_argument('--max-mb', type=float, default=STAGE_CACHE_MAX_BYTES / 2**20)
+
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        entries = cache_entries(args.cache_dir)
+        print(entries.drop(columns=['_last_used', '_bytes']).to_string(index=False, float_format='{:.2f}'.format))
+        print(f"\n{len(entries)} entries, {entries['size_mb'].sum():.1f} MB")
+    elif args.command == 'clear':
+        print(f"Removed {clear_cache(args.cache_dir, stage=args.stage)} entries")
+    else:
+        print(f"Evicted {evict(args.cache_dir, int(args.max_mb * 2**20))} entries")
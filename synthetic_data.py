@@ -0,0 +1,124 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Virginia's bounding box (lon, lat)
+VA_BOUNDS = (-83.68, 36.54, -75.24, 39.47)
+
+# (lon, lat, spread in degrees, relative weight) of the main crash hotspots
+HOTSPOTS = [
+    (-77.44, 37.54, 0.08, 0.16),   # Richmond
+    (-77.20, 38.85, 0.12, 0.26),   # Northern Virginia
+    (-76.29, 36.85, 0.10, 0.18),   # Norfolk / Virginia Beach
+    (-76.43, 37.03, 0.06, 0.06),   # Newport News / Hampton
+    (-79.94, 37.27, 0.05, 0.05),   # Roanoke
+    (-78.48, 38.03, 0.04, 0.03),   # Charlottesville
+    (-79.14, 37.41, 0.04, 0.03),   # Lynchburg
+    (-77.46, 38.30, 0.04, 0.03),   # Fredericksburg
+    (-78.87, 38.45, 0.03, 0.02),   # Harrisonburg
+    (-80.41, 37.23, 0.03, 0.02),   # Blacksburg
+    (-82.19, 36.60, 0.03, 0.01),   # Bristol
+]
+
+CATEGORIES = {
+    "Crash Severity": (["K", "A", "B", "C", "O"], [0.005, 0.03, 0.15, 0.10, 0.715]),
+    "Light Condition": (["1. Dawn", "2. Daylight", "3. Dusk", "4. Darkness - Road Lighted",
+                         "5. Darkness - Road Not Lighted", "6. Darkness - Unknown Road Lighting",
+                         "7. Unknown"],
+                        [0.02, 0.66, 0.03, 0.14, 0.12, 0.01, 0.02]),
+    "Roadway Surface Condition": (["1. Dry", "2. Wet", "3. Snowy", "4. Icy", "5. Muddy",
+                                   "6. Oil/Other Fluids", "7. Other", "8. Natural Debris",
+                                   "9. Water (Standing, Moving)", "10. Slush"],
+                                  [0.80, 0.15, 0.015, 0.01, 0.002, 0.002, 0.006, 0.005, 0.005, 0.005]),
+    "Relation To Roadway": (["1. Main-Line Roadway", "2. Acceleration/Deceleration Lanes",
+                             "5. On Entrance/Exit Ramp", "8. Non-Intersection", "9. Within Intersection",
+                             "10. Intersection Related - Within 150 Feet", "15. Other"],
+                            [0.35, 0.02, 0.05, 0.30, 0.15, 0.10, 0.03]),
+    "Roadway Alignment": (["1. Straight - Level", "2. Curve - Level", "3. Grade - Straight",
+                           "4. Grade - Curve", "5. Hillcrest - Straight", "6. Hillcrest - Curve"],
+                          [0.62, 0.12, 0.14, 0.07, 0.03, 0.02]),
+    "Roadway Surface Type": (["1. Concrete", "2. Blacktop, Asphalt, Bituminous", "3. Brick or Block",
+                              "4. Slag, Gravel, Stone", "5. Dirt", "6. Other"],
+                             [0.08, 0.88, 0.005, 0.02, 0.01, 0.005]),
+    "Roadway Defect": (["1. No Defects", "2. Holes, Ruts, Bumps", "3. Soft or Low Shoulder",
+                        "4. Under Repair", "5. Loose Material", "6. Restricted Width", "7. Other"],
+                       [0.95, 0.01, 0.005, 0.01, 0.01, 0.005, 0.01]),
+    "Intersection Type": (["1. Not at Intersection", "2. Two Approaches", "3. Three Approaches",
+                           "4. Four Approaches", "5. Five-Point, or More", "6. Roundabout"],
+                          [0.55, 0.05, 0.17, 0.21, 0.01, 0.01]),
+    "Traffic Control Type": (["1. No Traffic Control", "2. Officer or Flagger", "3. Traffic Signal",
+                              "4. Stop Sign", "5. Slow or Warning Sign", "6. Traffic Lanes Marked",
+                              "7. No Passing Lines", "8. Yield Sign", "9. One Way Road or Street",
+                              "10. Railroad Crossing"],
+                             [0.30, 0.005, 0.22, 0.10, 0.01, 0.30, 0.04, 0.015, 0.005, 0.005]),
+    "RoadDeparture Type": (["NOT_RD", "RD_LEFT", "RD_RIGHT", "RD_UNKNOWN"],
+                           [0.75, 0.09, 0.15, 0.01]),
+    "Intersection Analysis": (["Not Intersection", "VDOT Intersection", "Urban Intersection"],
+                              [0.60, 0.25, 0.15]),
+    "Alcohol?": (["No", "Yes"], [0.95, 0.05]),
+    "Distracted?": (["No", "Yes"], [0.85, 0.15]),
+    "Unrestrained?": (["Belted", "Unbelted"], [0.93, 0.07]),
+}
+
+def generate_crash_data(n_rows, seed=42, years=range(2014, 2026), n_intersections=5000,
+                        intersection_share=0.3, missing_share=0.01):
+    """Synthetic statewide crash extract with the columns the pipeline expects
+
+    Coordinates are drawn around Virginia's metro hotspots plus a uniform
+    statewide background. intersection_share of the crashes are geocoded onto
+    n_intersections shared locations, like real crashes at intersections and
+    mileposts, and missing_share have no coordinates.
+    """
+    rng = np.random.default_rng(seed)
+    lon_min, lat_min, lon_max, lat_max = VA_BOUNDS
+
+    weights = np.array([hotspot[3] for hotspot in HOTSPOTS])
+    background = 1 - weights.sum()
+    choice = rng.choice(len(HOTSPOTS) + 1, size=n_rows, p=np.append(weights, background))
+
+    centers = np.array([hotspot[:2] for hotspot in HOTSPOTS] + [(0, 0)])
+    spreads = np.array([hotspot[2] for hotspot in HOTSPOTS] + [0])
+    xy = centers[choice] + rng.normal(size=(n_rows, 2)) * spreads[choice, None]
+    is_background = choice == len(HOTSPOTS)
+    xy[is_background] = rng.uniform((lon_min, lat_min), (lon_max, lat_max), size=(is_background.sum(), 2))
+    xy = np.clip(xy, (lon_min, lat_min), (lon_max, lat_max))
+
+    # Snap a share of the crashes onto shared intersection locations
+    intersections = xy[rng.choice(n_rows, size=min(n_intersections, n_rows), replace=False)]
+    snapped = rng.random(n_rows) < intersection_share
+    xy[snapped] = intersections[rng.integers(0, len(intersections), size=snapped.sum())]
+
+    crash_data = pd.DataFrame({
+        "OBJECTID": np.arange(1, n_rows + 1),
+        "Document Nbr": rng.integers(100_000_000, 999_999_999, size=n_rows),
+        "Crash Year": rng.choice(np.asarray(years), size=n_rows),
+    })
+    for col, (values, probs) in CATEGORIES.items():
+        probs = np.asarray(probs) / np.sum(probs)
+        crash_data[col] = np.asarray(values, dtype=object)[rng.choice(len(values), size=n_rows, p=probs)]
+
+    max_speed_diff = np.round(rng.gamma(1.5, 6, size=n_rows))
+    max_speed_diff[rng.random(n_rows) < 0.2] = np.nan
+    crash_data["Max Speed Diff"] = max_speed_diff
+
+    missing = rng.random(n_rows) < missing_share
+    xy[missing] = np.nan
+    crash_data["x"] = np.round(xy[:, 0], 6)
+    crash_data["y"] = np.round(xy[:, 1], 6)
+
+    # Drawn last so that the other columns don't change with it
+    day_of_year = rng.integers(0, 365, size=n_rows)
+    crash_dates = pd.to_datetime(crash_data["Crash Year"].astype(str) + "-01-01") + pd.to_timedelta(day_of_year, unit='D')
+    crash_data.insert(3, "Crash Date", crash_dates.dt.strftime('%Y-%m-%d'))
+    return crash_data
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic Virginia crash extract")
+    parser.add_argument('n_rows', type=int)
+    parser.add_argument('--output', default='crash_data.csv')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    generate_crash_data(args.n_rows, seed=args.seed).to_csv(args.output, index=False)
+    print(f"Wrote {args.n_rows} synthetic crashes to {args.output}")